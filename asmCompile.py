@@ -249,7 +249,7 @@ def asmCompile(filename: str):
                 return None, f'Must move to register; Should be "{op} r[src] r[dest]"; Line {i}: "{lines[i]}"'
             
             add(asm.move(src, dest, opt))
-        elif op == 'ADD' or op == 'ADD_S' or op == 'OR' or op == 'AND' or op == "XOR":
+        elif op == 'ADD' or op == 'ADD_S' or op == 'ADD_F' or op == 'OR' or op == 'AND' or op == "XOR":
             if len(parts) != 4: return None, f'Invalid number of arguments for {op}; Should be "{op} r[reg] r[op1] r[op2]"; Line {i}: "{lines[i]}"'
             reg = parts[1]
             op1 = parts[2]
@@ -267,8 +267,10 @@ def asmCompile(filename: str):
                 op2 = int(op2[1:], 16)
             else: return None, f'Must read from register; Should be "{op} r[reg] r[op1] r[op2]"; Line {i}: "{lines[i]}"'
             
-            if op == 'AND' or op == 'AND_S':
+            if op == 'ADD' or op == 'ADD_S':
                 add(asm.addS(reg, op1, op2))
+            elif op == 'ADD_F':
+                add(asm.addF(reg, op1, op2))
             elif op == 'OR':
                 add(asm.orB(reg, op1, op2))
             elif op == 'AND':
@@ -287,6 +289,7 @@ def asmCompile(filename: str):
             if opr[0:2] == '0x':
                 opr = int(opr, 16)
             else: return None, f'Value must be number; Should be "{op} r[reg] [value]"; Line {i}: "{lines[i]}"'
+            if opr > 0xf: return None, f'Rotate amount must be between 0x0 and 0xF; Line {i}: "{lines[i]}"'
             
             add(asm.rotate(reg, opr))
         elif op == 'LOAD_P':
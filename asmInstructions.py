@@ -17,7 +17,7 @@ MOVE =      0x4 # MOVE spec srcReg destReg
 ADD_S =     0x5 # ADD_S destReg reg1 reg2
 """ Add 2 registers into destination register. ADD_S destReg reg1 reg2 """
 ADD_F =     0x6 # ADD_F destReg reg1 reg2
-""" UNIMPLEMENTED. ADD_F destReg reg1 reg2 """
+""" Add 2 registers as 8-bit floats (see minifloat.py) into destination register. ADD_F destReg reg1 reg2 """
 OR =        0x7 # OR destReg reg1 reg2
 """ Binary or 2 registers into destination register. OR destReg reg1 reg2 """
 AND =       0x8 # AND destReg reg1 reg2
@@ -25,7 +25,7 @@ AND =       0x8 # AND destReg reg1 reg2
 XOR =       0x9 # XOR destReg reg1 reg2
 """ Binary xor 2 registers into destination register. XOR destReg reg1 reg2 """
 ROTATE =    0xA # ROTATE reg x places
-""" Rotate the value in register by given amount. ROTATE reg x places """
+""" Rotate the value in register right by given amount, taken mod 8. ROTATE reg x places """
 JUMP =      0xB # JUMP reg instruction
 """ Jump to instruction if register is equal to r0. JUMP reg instruction """
 HALT =      0xC # HALT x x x
@@ -112,7 +112,7 @@ def strInstr(instr: int|tuple[bytes, bytes]):
     elif op == XOR:
         return f"XOR r{toHex(opr1,1)} ^ r{toHex(opr2,1)} -- > r{toHex(reg,1)}"
     elif op == ROTATE:
-        return f"ROTATE r{toHex(reg,1)} by 0x{toHex(opr2,1)} --> r{toHex(reg,1)}"
+        return f"ROTATE r{toHex(reg,1)} by 0x{toHex(opr2 & 0x7,1)} --> r{toHex(reg,1)}"
     elif op == JUMP:
         return f"JUMP IF r{toHex(reg,1)} = r0 TO i{toHex(opr,2)}"
     elif op == HALT:
@@ -151,6 +151,9 @@ def move(src: int, dest: int, opt: int=0x0):
 def addS(reg: int, op1: int, op2: int):
     """ Add (signed) values into register. r[op1] + r[op2] -> r[reg] """
     return toByte(ADD_S, reg, op1, op2)
+def addF(reg: int, op1: int, op2: int):
+    """ Add values as 8-bit floats into register. r[op1] + r[op2] -> r[reg] """
+    return toByte(ADD_F, reg, op1, op2)
 def orB(reg: int, op1: int, op2: int):
     """ OR registers into register. r[op1] | r[op2] -> r[reg]"""
     return toByte(OR, reg, op1, op2)
@@ -161,8 +164,8 @@ def xorB(reg: int, op1: int, op2: int):
     """ XOR registers into register. r[op1] ^ r[op2] -> r[reg]"""
     return toByte(XOR, reg, op1, op2)
 def rotate(reg: int, amt: int):
-    """ Rotate register by value. r[reg] >> amt -> r[reg]"""
-    return toByte(ROTATE, 0x0, reg, amt)
+    """ Rotate register right by value, mod 8. r[reg] >> amt -> r[reg]"""
+    return toByte(ROTATE, reg, 0x0, amt)
 def jump(reg: int, instr: int):
     """ Jump to instruction IF register 0 equals register. Jump If r[reg] == r[0] TO i[instr] """
     return toByte(JUMP, reg, instr, None)
@@ -0,0 +1,94 @@
+from __future__ import annotations
+from simpleMachine import CPU
+from peripherals import PerConsole, PerInput
+from batchRunner import compileSource
+
+import argparse
+import asyncio
+import time
+
+class StreamConsole(PerConsole):
+    """ Console that also writes every printed character to an asyncio stream """
+    def __init__(self, addr: int, writer: asyncio.StreamWriter):
+        super().__init__(addr)
+        self.writer = writer
+
+    def onStore(self, adr: int, value: int):
+        super().onStore(adr, value)
+        if value > 0x00 and not self.writer.is_closing():
+            self.writer.write(bytes((value,)))
+
+async def runMany(cpus: list[CPU], maxCycles: int|None = None, sliceCycles: int = 0x1000, jit=False):
+    """ Run CPUs concurrently on the running event loop. Returns their `RunResult`s in order """
+    return await asyncio.gather(*(cpu.runAsync(maxCycles, sliceCycles, jit) for cpu in cpus))
+
+async def _feed(reader: asyncio.StreamReader, per: PerInput):
+    try:
+        while data := await reader.read(0x400):
+            per.feed(data)
+    finally:
+        # Disconnected: let a parked CPU run on, reading 0, instead of waiting forever
+        per.close()
+
+async def runSession(image: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, inputAdr = 0x01, consoleAdr = 0x00,
+                     maxCycles: int|None = None, sliceCycles: int = 0x1000, jit=False):
+    """ Run a program for one connection, reading it through a `PerInput` at `inputAdr` and writing console
+    output back to it. The run result is sent when the CPU stops and returned. A closed connection reads as 0 """
+    cpu = CPU()
+    cpu.addPeripheral(StreamConsole(consoleAdr, writer))
+    per = PerInput(inputAdr)
+    cpu.addPeripheral(per)
+    cpu.loadMemFromBytes(image)
+    feeder = asyncio.create_task(_feed(reader, per))
+    try:
+        result = await cpu.runAsync(maxCycles, sliceCycles, jit)
+        if not writer.is_closing():
+            writer.write(f'\n{result}\n'.encode())
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+        return result
+    finally:
+        feeder.cancel()
+        writer.close()
+
+async def serve(image: bytes, host: str, port: int, inputAdr = 0x01, consoleAdr = 0x00, maxCycles: int|None = None, sliceCycles: int = 0x1000, jit=False):
+    """ Serve a program over TCP, running `runSession()` on its own CPU for each connection """
+    async def session(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await runSession(image, reader, writer, inputAdr, consoleAdr, maxCycles, sliceCycles, jit)
+    server = await asyncio.start_server(session, host, port)
+    async with server:
+        await server.serve_forever()
+
+async def _runCopies(image: bytes, copies: int, maxCycles: int|None, sliceCycles: int, jit: bool):
+    cpus = []
+    for _ in range(copies):
+        cpu = CPU()
+        cpu.addPeripheral(PerConsole(0x00))
+        cpu.loadMemFromBytes(image)
+        cpus.append(cpu)
+    start = time.perf_counter()
+    results = await runMany(cpus, maxCycles, sliceCycles, jit)
+    elapsed = time.perf_counter() - start
+    for i, result in enumerate(results):
+        print(f'{i}: {result}')
+    print(f'{sum(r.cycles for r in results)} cycles in {elapsed:.3f}s')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run copies of a machine program concurrently on one event loop, or serve it over TCP')
+    parser.add_argument('file', help='.bin, .asm or .basic source')
+    parser.add_argument('-n', '--copies', type=int, default=1, help='machines to run concurrently')
+    parser.add_argument('-c', '--max-cycles', type=int, default=None, help='cycle limit per machine')
+    parser.add_argument('-s', '--slice', type=int, default=0x1000, help='cycles run between yields to the event loop')
+    parser.add_argument('--jit', action='store_true', help='run compiled code')
+    parser.add_argument('--serve', type=int, default=None, metavar='PORT', help='serve a machine per TCP connection on this port')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--input', type=lambda s: int(s, 0), default=0x01, help='input peripheral address when serving')
+    args = parser.parse_args()
+
+    image = compileSource(args.file)
+    if args.serve is not None:
+        asyncio.run(serve(image, args.host, args.serve, args.input, maxCycles=args.max_cycles, sliceCycles=args.slice, jit=args.jit))
+    else:
+        asyncio.run(_runCopies(image, args.copies, args.max_cycles, args.slice, args.jit))
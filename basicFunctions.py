@@ -142,6 +142,10 @@ def rotate(pgm: BasicProgram, paramStr: str):
     
     if ra < 0 or ra >= 0x10:
         raise BasicCompileError(f'Rotation amount for rotate() must be between 0 and 15 (inclusive), was {ra}')
+    # A single ROTATE takes any amount, mod 8
+    ra %= 8
+    if ra == 0:
+        return
     
     vr = -1
     if not var.inReg():
@@ -152,7 +156,6 @@ def rotate(pgm: BasicProgram, paramStr: str):
     else:
         vr = var.rAdr
     
-    # pgm.addB(asm.rotate(vr, ra))
     pgm.addChunk(asm.rotate(vr, ra))
     var.modified = True
 basicFunctions['rotate'] = rotate
@@ -0,0 +1,213 @@
+from __future__ import annotations
+from simpleMachine import CPU, RunResult
+from basicCompile import BasicProgram
+from peripherals import PerConsole
+from cpuPool import CPUPool
+from cycleBound import CycleBound, analyze
+import asmCompile
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import argparse
+import json
+import os
+import sys
+import time
+
+sourceTypes = ('.bin', '.asm', '.basic')
+
+TIMEOUT = 'timeout'
+""" Run was stopped after using up its wall-time limit """
+ERROR = 'error'
+""" Run could not be compiled, loaded or raised while running """
+REJECTED = 'rejected'
+""" Program was not run because static analysis could not show it finishes within the cycle limit """
+
+class BatchTask:
+    """ One program run: a source file and the peripheral values to start it with """
+    def __init__(self, file: str, inputs: dict[int, int]|None = None, name: str|None = None):
+        self.file = file
+        self.inputs = inputs or {}
+        """ Peripheral address to value, written before the run starts """
+        self.name = name or file
+
+def loadManifest(filename: str):
+    """ Read tasks from a manifest. Each line is a source path, or a JSON object with
+    `file`, an optional `name` and an optional `inputs` list of peripheral maps (one run per map).
+    Relative paths are relative to the manifest, blank lines and lines starting with # are skipped """
+    base = os.path.dirname(filename)
+    tasks: list[BatchTask] = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            if line[0] != '{':
+                tasks.append(BatchTask(os.path.join(base, line)))
+                continue
+            entry = json.loads(line)
+            file = os.path.join(base, entry['file'])
+            inputSets = entry.get('inputs') or [{}]
+            for i, inputs in enumerate(inputSets):
+                name = entry.get('name', entry['file'])
+                if len(inputSets) > 1:
+                    name += f'[{i}]'
+                tasks.append(BatchTask(file, {int(k, 0): v for k, v in inputs.items()}, name))
+    return tasks
+
+def collectTasks(path: str):
+    """ Tasks for every source file in a directory tree, or every entry of a manifest file """
+    if os.path.isfile(path) and not path.endswith(sourceTypes):
+        return loadManifest(path)
+    if os.path.isfile(path):
+        return [BatchTask(path)]
+    tasks: list[BatchTask] = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith(sourceTypes):
+                tasks.append(BatchTask(os.path.join(root, file)))
+    return tasks
+
+def compileSource(filename: str):
+    """ Machine image for a .bin, .asm or .basic file. Raises Exception with the compile error """
+    if filename.endswith('.asm'):
+        machine, error = asmCompile.asmCompile(filename)
+        if not machine:
+            raise Exception(f'Asm compile error: {error}')
+        return b''.join(machine)
+    if filename.endswith('.basic'):
+        program = BasicProgram()
+        program.compile(filename)
+        if not program.compiled:
+            raise Exception(f'Basic compile error: {program.compileError}')
+        return b''.join(program.getMachine())
+    with open(filename, 'rb') as f:
+        return f.read()
+
+class BatchWorker:
+    """ Runs tasks on pooled CPUs, one pool per compiled image, so repeated runs of a program skip loading and decoding """
+    def __init__(self, maxCycles: int|None = None, timeout: float|None = None, consoleAdr = 0x00, sliceCycles = 0x4000, detectLoops = False, bound = False):
+        self.maxCycles = maxCycles
+        self.timeout = timeout
+        self.slice = sliceCycles
+        """ Cycles run between wall-time checks """
+        self.consoleAdr = consoleAdr
+        self.detectLoops = detectLoops
+        self.bound = bound
+        """ Bound each program with `cycleBound.analyze()` before running it: `mxEn` is set to its worst case and,
+        with `maxCycles` set, a program that may need more is rejected without running """
+        self.pools: dict[str, tuple[float, CPUPool, CycleBound|None]] = {}
+        """ Source file to (modification time, pool of CPUs with its image loaded, its cycle bound) """
+
+    def pool(self, filename: str):
+        """ Pool for a source file and its cycle bound if `bound` is set """
+        mtime = os.path.getmtime(filename)
+        cached = self.pools.get(filename)
+        if cached and cached[0] == mtime:
+            return cached[1], cached[2]
+        image = compileSource(filename)
+        bound = analyze(image) if self.bound else None
+        pool = CPUPool(image, lambda: [PerConsole(self.consoleAdr)], mxEn=bound.mxEn if bound and bound.bounded else None)
+        self.pools[filename] = (mtime, pool, bound)
+        return pool, bound
+
+    def runTask(self, task: BatchTask):
+        """ Run a task from a clean CPU. Returns its result as a dict """
+        result = {'name': task.name, 'file': task.file, 'reason': ERROR, 'exitCode': -1, 'cycles': 0, 'elapsed': 0.0, 'console': '', 'error': None}
+        start = time.perf_counter()
+        try:
+            pool, bound = self.pool(task.file)
+        except Exception as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+            result['elapsed'] = time.perf_counter() - start
+            return result
+        if bound:
+            result['bound'] = bound.cycles
+            if self.maxCycles is not None and (not bound.bounded or bound.cycles > self.maxCycles):
+                result['reason'] = REJECTED
+                result['error'] = f'worst case {bound.cycles} cycles is over the limit' if bound.bounded else '; '.join(
+                    [str(loop) for loop in bound.loops if loop.iterations is None] + bound.reasons)
+                result['elapsed'] = time.perf_counter() - start
+                return result
+        with pool.borrow() as cpu:
+            cpu.detectLoops = self.detectLoops
+            try:
+                for adr, v in task.inputs.items():
+                    cpu.peripheral[adr] = v
+                run = self._run(cpu)
+                result['reason'] = run.reason
+                if run.reason == RunResult.LOOP:
+                    result['loopEntry'] = run.loopEntry
+                    result['loopPeriod'] = run.loopPeriod
+            except Exception as e:
+                result['error'] = f'{type(e).__name__}: {e}'
+            result['exitCode'] = cpu.exitCode
+            result['cycles'] = cpu.en
+            result['console'] = cpu.peripherals[0].text
+        result['elapsed'] = time.perf_counter() - start
+        return result
+
+    def _run(self, cpu: CPU):
+        if self.timeout is None:
+            return cpu.run(self.maxCycles)
+        deadline = time.perf_counter() + self.timeout
+        left = self.maxCycles
+        while True:
+            n = self.slice if left is None else min(left, self.slice)
+            run = cpu.run(n)
+            if left is not None:
+                left -= n
+            if run.reason != RunResult.BUDGET or left == 0:
+                return run
+            if time.perf_counter() >= deadline:
+                run.reason = TIMEOUT
+                return run
+
+_worker: BatchWorker|None = None
+
+def _initWorker(maxCycles: int|None, timeout: float|None, consoleAdr: int, detectLoops: bool, bound: bool):
+    global _worker
+    _worker = BatchWorker(maxCycles, timeout, consoleAdr, detectLoops=detectLoops, bound=bound)
+
+def _runChunk(tasks: list[BatchTask]):
+    return [_worker.runTask(task) for task in tasks]
+
+def runBatch(tasks: list[BatchTask], workers: int|None = None, maxCycles: int|None = None, timeout: float|None = None, chunkSize = 4, consoleAdr = 0x00, detectLoops = False, bound = False):
+    """ Run tasks across a process pool, yielding each result dict as its chunk finishes.
+    At most two chunks per worker are queued at a time """
+    workers = workers or os.cpu_count() or 1
+    chunks = [tasks[i:i+chunkSize] for i in range(0, len(tasks), chunkSize)]
+    with ProcessPoolExecutor(workers, initializer=_initWorker, initargs=(maxCycles, timeout, consoleAdr, detectLoops, bound)) as pool:
+        pending = set()
+        nextChunk = 0
+        while nextChunk < len(chunks) or pending:
+            while nextChunk < len(chunks) and len(pending) < workers * 2:
+                pending.add(pool.submit(_runChunk, chunks[nextChunk]))
+                nextChunk += 1
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run machine programs headless across all cores, printing a JSON line per run')
+    parser.add_argument('path', help='source file, directory of .bin/.asm/.basic files, or manifest')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('-c', '--max-cycles', type=int, default=None, help='cycle limit per run')
+    parser.add_argument('-t', '--timeout', type=float, default=None, help='wall-time limit per run in seconds')
+    parser.add_argument('--chunk', type=int, default=4, help='runs per submitted task')
+    parser.add_argument('--console', type=lambda s: int(s, 0), default=0x00, help='console peripheral address')
+    parser.add_argument('-l', '--detect-loops', action='store_true', help='stop runs whose machine state repeats')
+    parser.add_argument('-b', '--bound', action='store_true', help='cap each program at its static worst-case cycles; with -c, reject programs that may need more')
+    parser.add_argument('-o', '--output', default=None, help='write JSON lines here instead of stdout')
+    args = parser.parse_args()
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    failed = 0
+    for result in runBatch(collectTasks(args.path), args.workers, args.max_cycles, args.timeout, args.chunk, args.console, args.detect_loops, args.bound):
+        if result['error'] or result['reason'] in (TIMEOUT, REJECTED):
+            failed += 1
+        out.write(json.dumps(result) + '\n')
+        out.flush()
+    if out is not sys.stdout:
+        out.close()
+    sys.exit(1 if failed else 0)
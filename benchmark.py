@@ -0,0 +1,88 @@
+from simpleMachine import CPU
+from basicCompile import BasicProgram
+from peripherals import PerConsole
+
+import sys
+import time
+
+programs = [
+    'bin/printAlpha.b.bin',
+    'bin/printAlpha2.b.bin',
+    'bin/test.a.bin',
+    'bin/test2.b.bin',
+    'basic/func.basic',
+    'basic/func2.basic',
+    'basic/printAlpha2.basic',
+]
+
+def loadImage(filename: str):
+    """ Load a program image from a .bin or .basic file """
+    if filename.endswith('.basic'):
+        program = BasicProgram()
+        program.compile(filename)
+        if not program.compiled:
+            raise Exception(f'Could not compile {filename}: {program.compileError}')
+        return b''.join(program.getMachine())
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def runSteps(cpu: CPU, image: bytes):
+    """ Run an image to completion with the single step loop. Returns the number of cycles """
+    cpu.reset()
+    cpu.loadMemFromBytes(image)
+    while cpu.step():
+        pass
+    return cpu.en
+
+def runFast(cpu: CPU, image: bytes):
+    """ Run an image to completion with `CPU.run()`. Returns the number of cycles """
+    cpu.reset()
+    cpu.loadMemFromBytes(image)
+    return cpu.run().cycles
+
+def runJit(cpu: CPU, image: bytes):
+    """ Run an image to completion with `CPU.run(jit=True)`. Returns the number of cycles """
+    cpu.reset()
+    cpu.loadMemFromBytes(image)
+    return cpu.run(jit=True).cycles
+
+def runOptions(**options):
+    """ Runner like `runFast()` with the given CPU run options set, e.g. `fastForward=False` """
+    def runner(cpu: CPU, image: bytes):
+        for name, value in options.items():
+            setattr(cpu, name, value)
+        return runFast(cpu, image)
+    return runner
+
+def bench(runner, image: bytes, minTime: float = 0.5, console=True):
+    """ Run an image repeatedly for at least `minTime` seconds. Returns steps per second """
+    cpu = CPU()
+    if console:
+        cpu.addPeripheral(PerConsole(0x00))
+    steps = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < minTime:
+        steps += runner(cpu, image)
+        elapsed = time.perf_counter() - start
+    return steps / elapsed
+
+runners = { # name: (runner, attach console)
+    'step': (runSteps, True),
+    'run': (runFast, True),
+    'run headless': (runFast, False),
+    'no forward': (runOptions(fastForward=False), True),
+    'detect': (runOptions(detectLoops=True), True),
+    'no fuse': (runOptions(fuse=False), True),
+    'jit': (runJit, True),
+    'jit headless': (runJit, False),
+}
+
+if __name__ == '__main__':
+    minTime = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+    names = list(runners.keys())
+    print(f'{"program":<26}' + ''.join(f'{name:>16}' for name in names))
+    for filename in programs:
+        image = loadImage(filename)
+        rates = [bench(runners[name][0], image, minTime, runners[name][1]) for name in names]
+        print(f'{filename:<26}' + ''.join(f'{rate:>14.0f}/s' for rate in rates))
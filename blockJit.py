@@ -0,0 +1,396 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from collections import OrderedDict
+import builtins
+import types
+
+import asmInstructions as asm
+from convert import toHex
+from minifloat import addTable
+
+if TYPE_CHECKING:
+    from simpleMachine import CPU
+
+MAX_BLOCK = 64
+""" Maximum number of instructions in one basic block """
+MAX_REGION = 64
+""" Maximum number of basic blocks compiled into one function """
+MAX_CHAIN = 3
+""" Maximum number of constant successors compiled inline after a block """
+
+CODE_CACHE_SIZE = 0x400
+""" Maximum number of compiled regions kept in `_codeCache` """
+
+_codeCache: OrderedDict[tuple, types.CodeType] = OrderedDict()
+""" Compiled region code shared by all CPUs, keyed by entry address and the memory it was compiled from.
+Least recently used first, so long-lived processes running many programs only keep the latest """
+
+_argNames = ('r', 'm', 'p', 'cov', 'd', 'fc', 'inv', 'cpu', 'bus', 'af')
+_globals = {'__builtins__': builtins}
+
+def _interpret(pc: int, limit: int):
+    """ Stand-in for code that must be interpreted; runs nothing """
+    return 0
+
+class Region:
+    """ Compiled function for the basic blocks reachable from an entry address """
+    def __init__(self, func, entries: list[int], spans: list[tuple[int, int]], mem: bytearray):
+        self.func = func
+        self.entries = entries
+        """ Block addresses the function can be entered at """
+        self.spans = spans
+        """ Memory ranges (start, end exclusive) the function was compiled from """
+        self.source = [bytes(mem[start:end]) for start, end in spans]
+
+    def overlaps(self, start: int, end: int):
+        for s, e in self.spans:
+            if s < end and e > start:
+                return True
+        return False
+
+    def matches(self, mem: bytearray):
+        """ If the memory still holds the code this region was compiled from """
+        for (start, end), source in zip(self.spans, self.source):
+            if mem[start:end] != source:
+                return False
+        return True
+
+class BlockJit:
+    """ Compiles machine code into Python functions. A basic block is a run of instructions ending at
+    a JUMP, JUMP_L, HALT or write to R_PGMI. Blocks reachable from an entry address are compiled into one
+    function that keeps the registers in locals and dispatches between blocks on the program index.
+    Functions are cached by entry address until a write to their memory invalidates them """
+    def __init__(self, cpu: CPU):
+        self.cpu = cpu
+        self.entries: list = [None] * 0x100
+        """ Compiled function to enter at each address """
+        self.regions: list[Region] = []
+        self.coverage = bytearray(0x100)
+        """ Number of regions compiled from each memory byte """
+        self.stale = False
+        """ Memory was reloaded; regions must be checked against it before running """
+
+    def invalidate(self, start: int = 0x00, end: int = 0x100):
+        """ Drop every region compiled from memory `start` to `end` (exclusive) """
+        for region in [region for region in self.regions if region.overlaps(start, end)]:
+            self._drop(region)
+
+    def _drop(self, region: Region):
+        self.regions.remove(region)
+        for adr in region.entries:
+            if self.entries[adr] is region.func:
+                self.entries[adr] = None
+        for start, end in region.spans:
+            for i in range(start, end):
+                self.coverage[i] -= 1
+
+    def _validate(self):
+        """ Keep only the regions whose code is unchanged since they were compiled """
+        mem = self.cpu.memory
+        for region in [region for region in self.regions if not region.matches(mem)]:
+            self._drop(region)
+        self.stale = False
+
+    def run(self, maxCycles: int|None = None):
+        """ Run compiled code, interpreting wherever it can not be used. Returns a `RunResult` reason """
+        from simpleMachine import RunResult
+        if self.stale:
+            self._validate()
+        cpu = self.cpu
+        entries = self.entries
+        mxEn = cpu.mxEn
+        budgetEn = None if maxCycles is None else cpu.en + maxCycles
+        while True:
+            en = cpu.en
+            limit = mxEn - 1 - en # instructions that can run before reaching mxEn
+            if budgetEn is not None and budgetEn - en < limit:
+                limit = budgetEn - en
+            adr = cpu.pgmi
+            n = 0
+            if adr < 0xff:
+                n = (entries[adr] or self._compile(adr))(adr, limit)
+            if cpu.waiting: # parked on a load, which may be the first instruction run
+                cpu.en = en + n
+                return RunResult.WAIT
+            if n > 0:
+                cpu.en = en + n
+            elif n < 0: # HALT or stack overflow
+                cpu.en = en - n
+                if cpu.memory[cpu.pgmi-2] >> 4 == asm.HALT:
+                    return RunResult.HALT
+                return RunResult.STACK_OVERFLOW
+            else:
+                # Interpret a single step near the end of the budget, at end of memory or on uncompilable code
+                if en == budgetEn:
+                    return RunResult.BUDGET
+                reason = cpu._runFast(1)
+                if reason != RunResult.BUDGET:
+                    return reason
+
+    def _compile(self, start: int):
+        """ Compile and cache the region entered at `start` """
+        cpu = self.cpu
+        mem = cpu.memory
+        blocks = _discover(mem, start)
+        if not blocks: # first instruction must be interpreted
+            region = Region(_interpret, [start], [(start, start+2)], mem)
+        else:
+            spans = _spans(blocks)
+            key = (start, tuple(spans), b''.join(bytes(mem[s:e]) for s, e in spans))
+            code = _codeCache.get(key)
+            if code is None:
+                source = translate(mem, blocks)
+                module = compile(source, f'<region {toHex(start)}>', 'exec')
+                code = next(c for c in module.co_consts if isinstance(c, types.CodeType))
+                _codeCache[key] = code
+                if len(_codeCache) > CODE_CACHE_SIZE:
+                    _codeCache.popitem(last=False)
+            else:
+                _codeCache.move_to_end(key)
+            defaults = (cpu.register, cpu.memory, cpu.peripheral, self.coverage, cpu._decoded, cpu._fuseCover, self._invalidateByte, cpu, cpu._bus, addTable())
+            func = types.FunctionType(code, _globals, f'region_{toHex(start)}', defaults)
+            region = Region(func, sorted(blocks), spans, mem)
+        self.regions.append(region)
+        for adr in region.entries:
+            if self.entries[adr] is None:
+                self.entries[adr] = region.func
+        for s, e in region.spans:
+            for i in range(s, e):
+                self.coverage[i] += 1
+        return region.func
+
+    def _invalidateByte(self, adr: int):
+        self.invalidate(adr, adr+1)
+
+def _isTerminator(inst: int):
+    op = inst >> 12
+    if op == asm.JUMP or op == asm.JUMP_L or op == asm.HALT:
+        return True
+    spec = (inst >> 8) & 0xf
+    return op == asm.MOVE and (spec == 0x2 or spec == 0x3) and (inst & 0xf) == asm.R_PGMI
+
+def _isCompilable(inst: int, adr: int):
+    """ Instructions that can raise are left to the interpreter so errors surface at the same cycle """
+    if inst >> 12 != asm.MOVE:
+        return True
+    spec = (inst >> 8) & 0xf
+    src = (inst >> 4) & 0xf
+    if (spec == 0x1 or spec == 0x3) and src == asm.R_EXIT: # exit code may not be a byte
+        return False
+    if (spec == 0x1 or spec == 0x3) and src == asm.R_PGMI and adr + 2 > 0xff: # program index past a byte
+        return False
+    return True
+
+def _scan(mem: bytearray, start: int):
+    """ Find the end address (exclusive) of the basic block starting at `start` """
+    adr = start
+    while adr < 0xff and adr - start < MAX_BLOCK*2:
+        inst = (mem[adr] << 8) | mem[adr+1]
+        if not _isCompilable(inst, adr):
+            break
+        adr += 2
+        if _isTerminator(inst):
+            break
+    return adr
+
+def _discover(mem: bytearray, entry: int):
+    """ Find the basic blocks reachable from `entry`. Returns block start to end address (exclusive) """
+    blocks: dict[int, int] = {}
+    work = [entry]
+    while work and len(blocks) < MAX_REGION:
+        start = work.pop()
+        if start in blocks or start >= 0xff:
+            continue
+        end = _scan(mem, start)
+        if end == start:
+            continue
+        blocks[start] = end
+        consts: dict[int, int] = {}
+        for adr in range(start, end, 2):
+            inst = (mem[adr] << 8) | mem[adr+1]
+            op = inst >> 12
+            reg = (inst >> 8) & 0xf
+            if op == asm.LOAD:
+                consts[reg] = inst & 0xff
+            elif op == asm.MOVE and reg == 0x2 and (inst & 0xf) == asm.R_STACK and (inst >> 4) & 0xf in consts:
+                work.append(consts[(inst >> 4) & 0xf]) # pushed return address
+            elif op == asm.MOVE and reg == 0x3 and inst & 0xff == (asm.R_PGMI << 4 | asm.R_STACK):
+                work.append(adr + 2)
+        last = (mem[end-2] << 8) | mem[end-1]
+        op = last >> 12
+        if op == asm.JUMP or op == asm.JUMP_L:
+            work.append(last & 0xff)
+            if not (op == asm.JUMP and (last >> 8) & 0xf == 0): # goto never falls through
+                work.append(end)
+        elif not _isTerminator(last):
+            work.append(end)
+    return blocks
+
+def _spans(blocks: dict[int, int]):
+    """ Merge block ranges into sorted, non-overlapping spans """
+    spans: list[tuple[int, int]] = []
+    for start, end in sorted(blocks.items()):
+        if spans and start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], end))
+        else:
+            spans.append((start, end))
+    return spans
+
+def _regsOf(inst: int):
+    """ Registers read and written by an instruction """
+    op = inst >> 12
+    reg = (inst >> 8) & 0xf
+    opr1 = (inst >> 4) & 0xf
+    opr2 = inst & 0xf
+    if op in (asm.LOAD_MEM, asm.LOAD, asm.LOAD_P):
+        return (), (reg,)
+    elif op in (asm.ADD_S, asm.ADD_F, asm.OR, asm.AND, asm.XOR):
+        return (opr1, opr2), (reg,)
+    elif op == asm.ROTATE:
+        return (reg,), (reg,)
+    elif op in (asm.STORE, asm.STORE_P):
+        return (reg,), ()
+    elif op in (asm.JUMP, asm.JUMP_L):
+        return (0, reg), ()
+    elif op == asm.MOVE:
+        if reg == 0x0:
+            return (opr1,), (opr2,)
+        elif reg == 0x1:
+            return (), (opr2,)
+        elif reg == 0x2:
+            return (opr1,), ()
+    return (), ()
+
+def translate(mem: bytearray|bytes, blocks: dict[int, int]):
+    """ Generate Python source for a region of basic blocks (start to end address, exclusive).
+    The function runs blocks until the program index leaves the region or the next block would pass `limit`
+    instructions. It returns the number of instructions run, negated if the CPU stopped """
+    used: set[int] = set()
+    written: set[int] = set()
+    for start, end in blocks.items():
+        for adr in range(start, end, 2):
+            reads, writes = _regsOf((mem[adr] << 8) | mem[adr+1])
+            used.update(reads)
+            written.update(writes)
+    used |= written
+
+    def exitLines(indent: str, pgmi: str, n: str):
+        return [f'{indent}r[{i}] = r{i}' for i in sorted(written)] + [f'{indent}cpu.pgmi = {pgmi}', f'{indent}return {n}']
+
+    def blockLines(indent: str, start: int, end: int, chain: int = 0):
+        size = (end - start) // 2
+        lines = [f'{indent}if n + {size} > limit:']
+        lines += exitLines(indent + '    ', str(start), 'n')
+        nextPc = str(end)
+        for j, adr in enumerate(range(start, end, 2), 1):
+            inst = (mem[adr] << 8) | mem[adr+1]
+            op = inst >> 12
+            reg = (inst >> 8) & 0xf
+            opr = inst & 0xff
+            opr1 = (inst >> 4) & 0xf
+            opr2 = inst & 0xf
+            nxt = adr + 2
+            lines.append(f'{indent}# {toHex(adr)}: {asm.strInstr(inst)}')
+            if op == asm.LOAD_MEM:
+                lines.append(f'{indent}r{reg} = m[{opr}]')
+            elif op == asm.LOAD:
+                lines.append(f'{indent}r{reg} = {opr}')
+            elif op == asm.STORE:
+                lines.append(f'{indent}m[{opr}] = r{reg}')
+                lines.append(f'{indent}d[{opr}] = None')
+                if opr > 0x00:
+                    lines.append(f'{indent}d[{opr-1}] = None')
+                lines.append(f'{indent}if fc[{opr}]: cpu._unfuse({opr})')
+                lines.append(f'{indent}if cov[{opr}]: # wrote to compiled code')
+                lines.append(f'{indent}    inv({opr})')
+                lines += exitLines(indent + '    ', str(nxt), f'n + {j}')
+            elif op == asm.MOVE:
+                if reg == 0x0:
+                    lines.append(f'{indent}r{opr2} = r{opr1}')
+                elif reg == 0x1:
+                    if opr1 == asm.R_PGMI:
+                        lines.append(f'{indent}r{opr2} = {nxt}')
+                    elif opr1 == asm.R_STACK:
+                        lines.append(f'{indent}r{opr2} = cpu.stack.pop() if cpu.stack else 0')
+                elif reg == 0x2:
+                    if opr2 == asm.R_PGMI:
+                        nextPc = f'r{opr1}'
+                    elif opr2 == asm.R_STACK:
+                        lines.append(f'{indent}cpu.stack.append(r{opr1})')
+                    elif opr2 == asm.R_EXIT:
+                        lines.append(f'{indent}cpu.exitCode = r{opr1}')
+                elif reg == 0x3:
+                    if opr1 == asm.R_PGMI:
+                        val = str(nxt)
+                    elif opr1 == asm.R_STACK:
+                        val = '(cpu.stack.pop() if cpu.stack else 0)'
+                    else:
+                        val = '0'
+                    if opr2 == asm.R_PGMI:
+                        lines.append(f'{indent}v = {val}')
+                        nextPc = 'v'
+                    elif opr2 == asm.R_STACK:
+                        lines.append(f'{indent}v = {val}')
+                        lines.append(f'{indent}if len(cpu.stack) > 0xff: # stack overflow')
+                        lines.append(f'{indent}    cpu.exitCode = 1')
+                        lines += exitLines(indent + '    ', str(nxt), f'-(n + {j})')
+                        lines.append(f'{indent}cpu.stack.append(v)')
+                    elif opr2 == asm.R_EXIT:
+                        lines.append(f'{indent}cpu.exitCode = {val}')
+                    elif opr1 == asm.R_STACK:
+                        lines.append(f'{indent}{val}')
+            elif op == asm.ADD_S:
+                lines.append(f'{indent}r{reg} = (r{opr1} + r{opr2}) & 0xff')
+            elif op == asm.ADD_F:
+                lines.append(f'{indent}r{reg} = af[(r{opr1} << 8) | r{opr2}]')
+            elif op == asm.OR:
+                lines.append(f'{indent}r{reg} = r{opr1} | r{opr2}')
+            elif op == asm.AND:
+                lines.append(f'{indent}r{reg} = r{opr1} & r{opr2}')
+            elif op == asm.XOR:
+                lines.append(f'{indent}r{reg} = r{opr1} ^ r{opr2}')
+            elif op == asm.ROTATE:
+                if opr2 & 0x7:
+                    lines.append(f'{indent}r{reg} = ((r{reg} >> {opr2 & 0x7}) | (r{reg} << {8 - (opr2 & 0x7)})) & 0xff')
+            elif op == asm.HALT:
+                lines += exitLines(indent, str(nxt), f'-(n + {j})')
+                return lines
+            elif op == asm.STORE_P:
+                lines.append(f'{indent}p[{opr}] = r{reg}')
+                lines.append(f'{indent}if bus[{opr}]: bus[{opr}].onStore({opr}, r{reg})')
+            elif op == asm.LOAD_P:
+                lines.append(f'{indent}if bus[{opr}] and bus[{opr}].onLoad({opr}) is False: # parked until input arrives')
+                lines.append(f'{indent}    cpu.waiting = bus[{opr}]')
+                lines += exitLines(indent + '    ', str(adr), f'n + {j - 1}')
+                lines.append(f'{indent}r{reg} = p[{opr}]')
+            elif op == asm.JUMP:
+                nextPc = str(opr) if reg == 0 else f'{opr} if r0 == r{reg} else {nxt}'
+            elif op == asm.JUMP_L:
+                nextPc = str(nxt) if reg == 0 else f'{opr} if r{reg} < r0 else {nxt}'
+        lines.append(f'{indent}n += {size}')
+        if nextPc.isdigit() and int(nextPc) in blocks and chain < MAX_CHAIN:
+            # Continue straight into a constant successor instead of going through the dispatch
+            return lines + blockLines(indent, int(nextPc), blocks[int(nextPc)], chain + 1)
+        lines.append(f'{indent}pc = {nextPc}')
+        return lines
+
+    starts = sorted(blocks)
+    def dispatch(indent: str, lo: int, hi: int):
+        """ Binary search on the program index for the block to run """
+        if hi - lo == 1:
+            lines = [f'{indent}if pc == {starts[lo]}:']
+            lines += blockLines(indent + '    ', starts[lo], blocks[starts[lo]])
+            lines.append(f'{indent}else:')
+            lines += exitLines(indent + '    ', 'pc', 'n')
+            return lines
+        mid = (lo + hi) // 2
+        return [f'{indent}if pc < {starts[mid]}:'] + dispatch(indent + '    ', lo, mid) + \
+            [f'{indent}else:'] + dispatch(indent + '    ', mid, hi)
+
+    lines = [f'def region(pc, limit, {", ".join(a + "=None" for a in _argNames)}):']
+    for i in sorted(used):
+        lines.append(f'    r{i} = r[{i}]')
+    lines.append('    n = 0')
+    lines.append('    while True:')
+    lines += dispatch('        ', 0, len(starts))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,57 @@
+from __future__ import annotations
+from typing import Callable
+from contextlib import contextmanager
+
+from simpleMachine import CPU, CPUState
+from peripherals import Peripheral
+
+RUN_OPTIONS = ('pr', 'journal', 'debugger', 'tracer', 'profiler', 'detectLoops', 'fuse', 'fastForward')
+""" CPU attributes a borrower may set that change how the next run behaves """
+
+class CPUPool:
+    """ Pre-built CPUs for many short runs. `acquire()` hands out a machine restored to the template state: the base
+    image in memory, fresh peripherals from `peripherals()` and the template's run options. Restoring copies registers and peripheral memory,
+    while memory is only copied back when a run wrote to it, so decoded and compiled code is kept between runs """
+    def __init__(self, image: bytes|None = None, peripherals: Callable[[], list[Peripheral]]|None = None, size: int = 0, adr: int = 0x00, mxEn: int|None = None):
+        self.template = CPU()
+        for per in (peripherals() if peripherals else []):
+            self.template.addPeripheral(per)
+        if mxEn is not None:
+            self.template.mxEn = mxEn
+        self.state: CPUState = self.template.snapshot()
+        """ State every acquired CPU starts from """
+        if image is not None:
+            self.setImage(image, adr)
+        self._free: list[CPU] = [self.template.fork() for _ in range(size)]
+
+    def setImage(self, image: bytes, adr: int = 0x00):
+        """ Change the base image. The image is shared by every machine; CPUs already handed out keep running their copy """
+        self.template.reset()
+        self.template.loadMemFromBytes(image, adr)
+        self.state = self.template.snapshot()
+
+    def acquire(self):
+        """ A CPU in the template state """
+        cpu = self._free.pop() if self._free else self.template.fork()
+        cpu.restore(self.state)
+        # Run options set by the last borrower go back to the template's
+        template = self.template
+        for name in RUN_OPTIONS:
+            setattr(cpu, name, getattr(template, name))
+        return cpu
+
+    def release(self, cpu: CPU):
+        """ Return a CPU from `acquire()` for reuse """
+        self._free.append(cpu)
+
+    @contextmanager
+    def borrow(self):
+        """ `acquire()` a CPU for a with block and release it after """
+        cpu = self.acquire()
+        try:
+            yield cpu
+        finally:
+            self.release(cpu)
+
+    def __len__(self):
+        return len(self._free)
@@ -0,0 +1,497 @@
+from __future__ import annotations
+from minifloat import addTable
+import asmInstructions as asm
+
+import argparse
+import sys
+
+MAX_DEPTH = 0x10
+""" Values on the stack followed before giving up; deeper call chains are treated as recursion """
+MAX_NODES = 0x4000
+""" (address, stack) nodes explored before giving up """
+MAX_ITER = 0x100
+""" An 8-bit induction variable repeats within this many iterations, so an exit not taken by then never is """
+
+MAX_WALK = 0x100
+""" Instructions followed through one iteration once past `MAX_FOLLOW` """
+MAX_FOLLOW = 0x8000
+""" Instructions followed through the iterations of a loop, over all their paths, before falling back to
+bounding it by its longest iteration """
+
+END = (0x100, ())
+""" Node for running off the end of memory, which takes one more cycle """
+
+class _NoBound(Exception):
+    """ The program has no bound the analysis can show """
+
+class LoopBound:
+    """ A loop found in the image: its header, the most iterations it can make per entry and the cycles that costs """
+    def __init__(self, header: int, depth: int, iterations: int|None, cycles: int|None, reason: str = ''):
+        self.header = header
+        self.depth = depth
+        """ Values on the stack at the header, i.e. the call depth for compiled BASIC """
+        self.iterations = iterations
+        """ Most back edges taken per entry; None if unbounded """
+        self.cycles = cycles
+        """ Most cycles per entry, including the final partial iteration """
+        self.reason = reason
+        """ Why no bound was derived """
+
+    def __str__(self):
+        where = f'loop at i{self.header:02X}' + (f' (depth {self.depth})' if self.depth else '')
+        if self.iterations is None:
+            return f'{where}: {self.reason}'
+        return f'{where}: at most {self.iterations} iterations, {self.cycles} cycles'
+
+class CycleBound:
+    """ Result of `analyze()`: a worst-case cycle count valid for any peripheral input, or None with the reasons why not """
+    def __init__(self, cycles: int|None, loops: list[LoopBound], reasons: list[str], instructions: int):
+        self.cycles = cycles
+        self.loops = loops
+        self.reasons = reasons
+        self.instructions = instructions
+        """ Reachable instructions """
+
+    @property
+    def bounded(self):
+        return self.cycles is not None
+
+    @property
+    def mxEn(self):
+        """ Smallest `CPU.mxEn` that lets every run finish """
+        return None if self.cycles is None else self.cycles + 1
+
+    def __str__(self):
+        lines = [str(loop) for loop in self.loops]
+        lines += self.reasons
+        lines.append(f'worst case {self.cycles} cycles' if self.bounded else 'unbounded')
+        return '\n'.join(lines)
+
+def _defined(inst: int):
+    """ Register an instruction writes, or None """
+    op = inst >> 12
+    reg = (inst >> 8) & 0xf
+    if op in (asm.LOAD_MEM, asm.LOAD, asm.LOAD_P, asm.ADD_S, asm.ADD_F, asm.OR, asm.AND, asm.XOR, asm.ROTATE):
+        return reg
+    if op == asm.MOVE and reg in (0x0, 0x1):
+        return inst & 0xf
+    return None
+
+def _join(a: tuple, b: tuple):
+    """ Values known in both `a` and `b` """
+    return a if a is b else tuple(x if x == y else None for x, y in zip(a, b))
+
+class _Analysis:
+    def __init__(self, image: bytes):
+        self.mem = bytes(image) + bytes(0x100 - len(image))
+        self.states: dict[tuple, tuple[tuple, tuple]] = {}
+        """ Node to the merged register and memory values before it runs; None for a value that is not constant """
+        self.succ: dict[tuple, set[tuple]] = {}
+        self.stores: set[int] = set()
+        """ Memory addresses written by STORE """
+
+    def inst(self, adr: int):
+        return (self.mem[adr] << 8) | self.mem[adr+1]
+
+    def step(self, node: tuple, state: tuple):
+        """ Successor nodes of `node` and the state on entering each """
+        adr, stack = node
+        if node == END:
+            return []
+        inst = self.inst(adr)
+        op = inst >> 12
+        reg = (inst >> 8) & 0xf
+        opr = inst & 0xff
+        opr1 = opr >> 4
+        opr2 = opr & 0xf
+        s = list(state[0])
+        mem = state[1]
+        nxt = adr + 2
+        if op == asm.HALT:
+            return []
+        elif op == asm.LOAD_MEM:
+            s[reg] = mem[opr]
+        elif op == asm.LOAD:
+            s[reg] = opr
+        elif op == asm.STORE:
+            if mem[opr] != s[reg]:
+                mem = mem[:opr] + (s[reg],) + mem[opr+1:]
+            self.stores.add(opr)
+        elif op == asm.MOVE:
+            if reg == 0x0:
+                s[opr2] = s[opr1]
+            elif reg in (0x1, 0x2, 0x3):
+                val = s[opr1] if reg == 0x2 else None
+                if reg in (0x1, 0x3):
+                    if opr1 == asm.R_PGMI:
+                        val = nxt
+                    elif opr1 == asm.R_STACK:
+                        val = stack[-1] if stack else 0x00
+                        stack = stack[:-1]
+                    elif opr1 != asm.R_EXIT:
+                        val = 0x00
+                if reg == 0x1:
+                    if opr1 in (asm.R_PGMI, asm.R_STACK, asm.R_EXIT):
+                        s[opr2] = val
+                elif opr2 == asm.R_PGMI:
+                    if val is None:
+                        raise _NoBound(f'jump to a computed address at i{adr:02X}')
+                    nxt = val
+                elif opr2 == asm.R_STACK:
+                    stack = stack + (val,)
+                    if len(stack) > MAX_DEPTH:
+                        raise _NoBound(f'stack deeper than {MAX_DEPTH} at i{adr:02X}, e.g. recursion')
+        elif op in (asm.ADD_S, asm.ADD_F, asm.OR, asm.AND, asm.XOR):
+            a, b = s[opr1], s[opr2]
+            if a is None or b is None:
+                s[reg] = None
+            elif op == asm.ADD_S:
+                s[reg] = (a + b) & 0xff
+            elif op == asm.ADD_F:
+                s[reg] = addTable()[(a << 8) | b]
+            else:
+                s[reg] = a | b if op == asm.OR else a & b if op == asm.AND else a ^ b
+        elif op == asm.ROTATE:
+            v, n = s[reg], opr2 & 0x7
+            s[reg] = None if v is None else ((v >> n) | (v << (8 - n))) & 0xff
+        elif op == asm.LOAD_P:
+            s[reg] = None
+        elif op in (asm.JUMP, asm.JUMP_L):
+            a, b = s[0], s[reg]
+            if op == asm.JUMP and reg == 0x0:
+                taken = (True,)
+            elif op == asm.JUMP_L and reg == 0x0:
+                taken = (False,)
+            elif a is None or b is None:
+                taken = (True, False)
+            else:
+                taken = (a == b if op == asm.JUMP else b < a,)
+            state = (tuple(s), mem)
+            return [(self.node(opr if t else nxt, stack), state) for t in taken]
+        return [(self.node(nxt, stack), (tuple(s), mem))]
+
+    def node(self, adr: int, stack: tuple):
+        return END if adr >= 0xff else (adr, stack)
+
+    def explore(self):
+        """ Propagate constants over (address, stack) nodes from the entry until nothing changes, recording every edge """
+        entry = (0x00, ())
+        self.states[entry] = (tuple(bytes(0x10)), tuple(self.mem))
+        work = [entry]
+        while work:
+            node = work.pop()
+            edges = self.succ.setdefault(node, set())
+            for succ, state in self.step(node, self.states[node]):
+                edges.add(succ)
+                old = self.states.get(succ)
+                new = state if old is None else (_join(old[0], state[0]), _join(old[1], state[1]))
+                if new != old:
+                    self.states[succ] = new
+                    work.append(succ)
+                    if len(self.states) > MAX_NODES:
+                        raise _NoBound(f'more than {MAX_NODES} reachable states')
+        code = {adr + i for adr, _ in self.states if adr < 0xff for i in (0, 1)}
+        clash = sorted(self.stores & code)
+        if clash:
+            raise _NoBound(f'STORE to m{clash[0]:02X} changes code')
+        return entry
+
+def _order(entry: tuple, succ: dict[tuple, set[tuple]]):
+    """ Nodes in reverse postorder """
+    seen = {entry}
+    post = []
+    stack = [(entry, iter(succ[entry]))]
+    while stack:
+        node, it = stack[-1]
+        for s in it:
+            if s not in seen:
+                seen.add(s)
+                stack.append((s, iter(succ[s])))
+                break
+        else:
+            post.append(node)
+            stack.pop()
+    return post[::-1]
+
+def _dominators(order: list[tuple], preds: dict[tuple, list[tuple]]):
+    """ Immediate dominator of every node (Cooper, Harvey and Kennedy) """
+    index = {n: i for i, n in enumerate(order)}
+    idom = {order[0]: order[0]}
+    def intersect(a, b):
+        while a != b:
+            while index[a] > index[b]:
+                a = idom[a]
+            while index[b] > index[a]:
+                b = idom[b]
+        return a
+    changed = True
+    while changed:
+        changed = False
+        for n in order[1:]:
+            new = None
+            for p in preds[n]:
+                if p in idom:
+                    new = p if new is None else intersect(p, new)
+            if idom.get(n) != new:
+                idom[n] = new
+                changed = True
+    return idom
+
+def _longest(start: tuple, nodes: set[tuple], edges: dict[tuple, set[tuple]], cost: dict[tuple, int]):
+    """ Most cycles on a path from `start` to each node of an acyclic graph, counting both ends """
+    indeg = {n: 0 for n in nodes}
+    for n in nodes:
+        for s in edges[n]:
+            indeg[s] += 1
+    ready = [n for n in nodes if indeg[n] == 0]
+    dist = {start: cost[start]}
+    done = 0
+    while ready:
+        n = ready.pop()
+        done += 1
+        for s in edges[n]:
+            if n in dist:
+                dist[s] = max(dist.get(s, 0), dist[n] + cost[s])
+            indeg[s] -= 1
+            if indeg[s] == 0:
+                ready.append(s)
+    if done != len(nodes):
+        raise _NoBound('irreducible control flow')
+    return dist
+
+def analyze(image: bytes):
+    """ Worst-case cycles for running `image` from address 0 with any peripheral input. Recovers the control flow
+    graph from jumps and stack returns by propagating constants, with the stack contents as context. A loop is bounded
+    by an 8-bit counter stepped by a constant once per iteration: iterations are followed with the counter known until
+    one must exit. Loops whose iterations could all be followed cost the sum of their longest paths; others cost the
+    bound times their longest iteration, with inner loops costed first """
+    analysis = _Analysis(image)
+    try:
+        entry = analysis.explore()
+    except _NoBound as e:
+        return CycleBound(None, [], [str(e)], len(analysis.states))
+    succ = analysis.succ
+    order = _order(entry, succ)
+    preds: dict[tuple, list[tuple]] = {n: [] for n in order}
+    for n in order:
+        for s in succ[n]:
+            preds[s].append(n)
+    idom = _dominators(order, preds)
+    def dominates(a, b):
+        while b != a and idom[b] != b:
+            b = idom[b]
+        return a == b
+
+    bodies: dict[tuple, set[tuple]] = {}
+    """ Loop header to its body, merging the natural loops of every back edge into it """
+    for n in order:
+        for h in succ[n]:
+            if dominates(h, n):
+                body = bodies.setdefault(h, {h})
+                work = [n]
+                while work:
+                    m = work.pop()
+                    if m not in body:
+                        body.add(m)
+                        work.extend(preds[m])
+
+    rep = {n: n for n in order}
+    """ Node to the header of the outermost loop collapsed so far that contains it """
+    cost = {n: 1 for n in order}
+    ends = {n: not succ[n] for n in order}
+    """ Whether the program can stop inside the node """
+    found: dict[tuple, LoopBound] = {}
+    """ Header to what is known of its loop """
+    inner: dict[tuple, set[tuple]] = {}
+    """ Header to body of each loop handled so far """
+    unbounded: set[tuple] = set()
+    for h in sorted(bodies, key=lambda h: len(bodies[h])):
+        body = bodies[h]
+        nested = set().union(*(inner[g] for g in inner if g in body))
+        inner[h] = body
+        iterations, exact = _loopBound(analysis, h, body, nested, succ, preds, dominates)
+        if exact is not None:
+            # Followed through every iteration, so loops inside need no bound of their own
+            for g in unbounded & body:
+                found[g].reason = f'followed through by the loop at i{h[0]:02X}'
+            unbounded -= body
+        elif any(g in body for g in unbounded):
+            iterations, reason = None, 'unbounded, contains an unbounded loop'
+        elif iterations is None:
+            reason = 'unbounded, no counter found that decides an exit'
+        if iterations is None:
+            unbounded.add(h)
+            found[h] = LoopBound(h[0], len(h[1]), None, None, reason)
+            continue
+        reps = {rep[n] for n in body}
+        if exact is None:
+            edges = {r: set() for r in reps}
+            latches = set()
+            exits = {r for r in reps if ends[r]}
+            for n in body:
+                for s in succ[n]:
+                    if s == h:
+                        latches.add(rep[n])
+                    elif s not in body:
+                        exits.add(rep[n])
+                    elif rep[s] != rep[n]:
+                        edges[rep[n]].add(rep[s])
+            try:
+                dist = _longest(h, reps, edges, cost)
+            except _NoBound as e:
+                unbounded.add(h)
+                found[h] = LoopBound(h[0], len(h[1]), None, None, f'unbounded, {e}')
+                continue
+            exact = iterations * max(dist[r] for r in latches) + max((dist[r] for r in exits if r in dist), default=0)
+        found[h] = LoopBound(h[0], len(h[1]), iterations, exact)
+        ends[h] = any(ends[r] for r in reps)
+        cost[h] = exact
+        for n in body:
+            rep[n] = h
+
+    loops = sorted(found.values(), key=lambda loop: (loop.header, loop.depth))
+    if unbounded:
+        return CycleBound(None, loops, [], len(order))
+    reps = {rep[n] for n in order}
+    edges = {r: set() for r in reps}
+    for n in order:
+        for s in succ[n]:
+            if rep[s] != rep[n]:
+                edges[rep[n]].add(rep[s])
+    try:
+        dist = _longest(rep[entry], reps, edges, cost)
+    except _NoBound as e:
+        return CycleBound(None, loops, [str(e)], len(order))
+    return CycleBound(max(dist.values()), loops, [], len(order))
+
+def _loopBound(analysis: _Analysis, h: tuple, body: set[tuple], nested: set[tuple], succ: dict, preds: dict, dominates):
+    """ Most iterations of the loop at `h` and, if every iteration could be followed, the most cycles it takes per entry.
+    For each counter (see `_counter()`) and value it can enter with, iterations are followed from the header with
+    the counter's value known until one is certain to leave the loop """
+    latches = [n for n in body if h in succ[n]]
+    best = None
+    exact = None
+    for v in range(0x10):
+        starts = _counter(analysis, h, body, nested, latches, preds, v, dominates)
+        if not starts:
+            continue
+        runs = [_iterate(analysis, h, body, v, c0, step) for c0, step in starts]
+        if any(j is None for j, _ in runs):
+            continue
+        n = max(j for j, _ in runs)
+        best = n if best is None else min(best, n)
+        if all(cycles is not None for _, cycles in runs):
+            cycles = max(cycles for _, cycles in runs)
+            exact = cycles if exact is None else min(exact, cycles)
+    return best, exact
+
+def _counter(analysis: _Analysis, h: tuple, body: set[tuple], nested: set[tuple], latches: list[tuple], preds: dict, v: int, dominates):
+    """ (start, step) for each value register `v` can enter the loop with, if `v` is only written in the loop
+    by a single `ADD_S v, v + k` with a constant k that runs once on every iteration """
+    states = analysis.states
+    defs = [n for n in body if _defined(analysis.inst(n[0])) == v]
+    if len(defs) != 1 or defs[0] in nested or not all(dominates(defs[0], n) for n in latches):
+        return None
+    inc = defs[0]
+    inst = analysis.inst(inc[0])
+    opr1, opr2 = (inst >> 4) & 0xf, inst & 0xf
+    if inst >> 12 != asm.ADD_S or opr1 == opr2 or v not in (opr1, opr2):
+        return None
+    step = states[inc][0][opr2 if opr1 == v else opr1]
+    if step is None:
+        return None
+    starts = set()
+    for p in preds[h]:
+        if p in body:
+            continue
+        for s, state in analysis.step(p, states[p]):
+            if s == h:
+                starts.add(state[0][v])
+    if h == (0x00, ()):
+        starts.add(0x00)
+    if None in starts:
+        return None
+    return [(c0, step) for c0 in sorted(starts)]
+
+def _iterate(analysis: _Analysis, h: tuple, body: set[tuple], v: int, c0: int, step: int):
+    """ First iteration certain to leave the loop when counter `v` enters the header as `c0 + step * i` in iteration i,
+    and the most cycles up to leaving it. Iterations are followed as in `_follow()` for up to `MAX_FOLLOW` instructions
+    in all; after that only while branches are decided and without the cycles. (None, None) if no iteration is certain to leave """
+    total = 0
+    budget = MAX_FOLLOW
+    for j in range(MAX_ITER + 1):
+        regs = list(analysis.states[h][0])
+        regs[v] = (c0 + step * j) & 0xff
+        state = (tuple(regs), analysis.states[h][1])
+        followed = None if total is None else _follow(analysis, h, body, state, budget)
+        if followed is None:
+            total = None
+            if _leaves(analysis, h, body, state):
+                return j, None
+            continue
+        cycles, leaves, steps = followed
+        total += cycles
+        budget -= steps
+        if leaves:
+            return j, total
+    return None, None
+
+def _leaves(analysis: _Analysis, h: tuple, body: set[tuple], state: tuple):
+    """ Whether an iteration from the header in `state` is certain to leave the loop, following it for up to
+    `MAX_WALK` instructions while every branch is decided by known values """
+    node = h
+    for _ in range(MAX_WALK):
+        nxt = analysis.step(node, state)
+        if len(nxt) != 1:
+            return not nxt
+        node, state = nxt[0]
+        if node not in body:
+            return True
+        if node == h:
+            return False
+    return False
+
+def _follow(analysis: _Analysis, h: tuple, body: set[tuple], state: tuple, budget: int):
+    """ Most cycles of one iteration from the header in `state`, whether every path through it leaves the loop and
+    the instructions followed. Both sides of a branch not decided by known values are followed, as are nested loops.
+    None if that takes more than `budget` instructions """
+    paths = [(h, state, 0)]
+    worst = 0
+    leaves = True
+    steps = 0
+    while paths:
+        node, state, cycles = paths.pop()
+        if node == h and cycles:
+            worst = max(worst, cycles)
+            leaves = False
+            continue
+        if node not in body:
+            worst = max(worst, cycles)
+            continue
+        steps += 1
+        if steps > budget:
+            return None
+        nxt = analysis.step(node, state)
+        if not nxt:
+            worst = max(worst, cycles + 1)
+        paths.extend((s, state, cycles + 1) for s, state in nxt)
+    return worst, leaves, steps
+
+if __name__ == '__main__':
+    from batchRunner import compileSource
+    parser = argparse.ArgumentParser(description='Bound the cycles a machine program can take, without running it')
+    parser.add_argument('files', nargs='+', help='.bin, .asm or .basic sources')
+    args = parser.parse_args()
+
+    unbounded = 0
+    for file in args.files:
+        print(f'== {file}')
+        try:
+            bound = analyze(compileSource(file))
+        except Exception as e:
+            print(e)
+            unbounded += 1
+            continue
+        unbounded += not bound.bounded
+        print(bound)
+    sys.exit(1 if unbounded else 0)
@@ -0,0 +1,157 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import operator
+
+import asmInstructions as asm
+from convert import toHex
+
+if TYPE_CHECKING:
+    from simpleMachine import CPU
+
+READ = 0x1
+WRITE = 0x2
+
+B_BREAK = 'break'
+""" Address breakpoint; the CPU stops before the instruction runs """
+B_MEMORY = 'memory'
+""" Memory watchpoint; the CPU stops after the access """
+B_PERIPHERAL = 'peripheral'
+""" Peripheral watchpoint; the CPU stops after the access """
+B_REGISTER = 'register'
+""" Register condition; the CPU stops after the write that made it true """
+
+conditionOps = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+# Op codes that write the register in their reg field
+_regDest = {asm.LOAD_MEM, asm.LOAD, asm.ADD_S, asm.ADD_F, asm.OR, asm.AND, asm.XOR, asm.ROTATE, asm.LOAD_P}
+
+class DebugStop:
+    """ Why `CPU.run()` stopped with `RunResult.BREAK` """
+    def __init__(self, kind: str, adr: int, en: int, target: int|None = None, access: int|None = None):
+        self.kind = kind
+        self.adr = adr
+        """ Address of the instruction that stopped the CPU """
+        self.en = en
+        """ Cycle the CPU stopped at """
+        self.target = target
+        """ Watched address or register """
+        self.access = access
+        """ `READ` or `WRITE` for watchpoints """
+
+    def __str__(self):
+        where = f'i{toHex(self.adr,2)} cycle {self.en}'
+        if self.kind == B_BREAK:
+            return f'Breakpoint at {where}'
+        if self.kind == B_REGISTER:
+            return f'Register r{toHex(self.target,1)} condition at {where}'
+        access = 'read' if self.access == READ else 'write'
+        prefix = 'm' if self.kind == B_MEMORY else 'p'
+        return f'Watchpoint {access} {prefix}{toHex(self.target,2)} at {where}'
+
+class Debugger:
+    """ Breakpoints, watchpoints and register conditions for `CPU.run()`. Attach with `cpu.debugger = debugger`.
+    Each instruction word is checked once against the watchpoints and conditions and the answer kept in a table,
+    so a run only pays for a table lookup per cycle. With nothing set `run()` uses its usual loops """
+    def __init__(self):
+        self.breakpoints = bytearray(0x100)
+        """ Non-zero at instruction addresses to stop before """
+        self.memWatch = bytearray(0x100)
+        """ `READ`|`WRITE` flags per memory address """
+        self.perWatch = bytearray(0x100)
+        """ `READ`|`WRITE` flags per peripheral address """
+        self.conditions: list[list[tuple]] = [[] for _ in range(0x10)]
+        """ (compare, value) conditions per register """
+        self._hits = bytearray(0x10000)
+        """ Per instruction word: 0 not checked yet, 1 no watchpoint or condition applies, 2 one may apply """
+        self._count = 0
+        self.lastStop: DebugStop|None = None
+
+    def active(self):
+        return self._count > 0
+
+    def _changed(self):
+        self._hits[:] = bytes(0x10000)
+        self._count = sum(1 for b in self.breakpoints if b) + sum(1 for w in self.memWatch if w) + sum(1 for w in self.perWatch if w) + sum(len(c) for c in self.conditions)
+
+    def addBreakpoint(self, adr: int):
+        self.breakpoints[adr] = 1
+        self._changed()
+    def removeBreakpoint(self, adr: int):
+        self.breakpoints[adr] = 0
+        self._changed()
+
+    def watchMemory(self, adr: int, access = READ|WRITE):
+        """ Stop after an instruction reads or writes memory `adr`, e.g. a BASIC `Variable.mAdr` """
+        self.memWatch[adr] = access
+        self._changed()
+    def watchPeripheral(self, adr: int, access = READ|WRITE):
+        self.perWatch[adr] = access
+        self._changed()
+
+    def addCondition(self, reg: int, compare: str, value: int):
+        """ Stop after an instruction writes register `reg` and `r[reg] compare value` holds. `compare` is a key of `conditionOps` """
+        if compare not in conditionOps:
+            raise ValueError(f'Unknown comparison "{compare}"; Must be one of {", ".join(conditionOps)}')
+        self.conditions[reg].append((conditionOps[compare], value))
+        self._changed()
+
+    def clear(self):
+        self.breakpoints[:] = bytes(0x100)
+        self.memWatch[:] = bytes(0x100)
+        self.perWatch[:] = bytes(0x100)
+        self.conditions = [[] for _ in range(0x10)]
+        self._changed()
+
+    def hits(self, inst: int):
+        """ True if a watchpoint or condition may stop the CPU after `inst` """
+        hit = self._hits[inst]
+        if not hit:
+            hit = 2 if self._accesses(inst) or self._writesCondition(inst) is not None else 1
+            self._hits[inst] = hit
+        return hit == 2
+
+    def _accesses(self, inst: int):
+        """ (kind, address, access) watched by `inst`, or None """
+        op = inst >> 12
+        adr = inst & 0xff
+        if op == asm.LOAD_MEM and self.memWatch[adr] & READ:
+            return (B_MEMORY, adr, READ)
+        if op == asm.STORE and self.memWatch[adr] & WRITE:
+            return (B_MEMORY, adr, WRITE)
+        if op == asm.LOAD_P and self.perWatch[adr] & READ:
+            return (B_PERIPHERAL, adr, READ)
+        if op == asm.STORE_P and self.perWatch[adr] & WRITE:
+            return (B_PERIPHERAL, adr, WRITE)
+        return None
+
+    def _writesCondition(self, inst: int):
+        """ Register with conditions written by `inst`, or None """
+        op = inst >> 12
+        reg = (inst >> 8) & 0xf
+        if op in _regDest:
+            dest = reg
+        elif op == asm.MOVE and reg < 2:
+            dest = inst & 0xf
+        else:
+            return None
+        return dest if self.conditions[dest] else None
+
+    def check(self, cpu: CPU, adr: int, inst: int):
+        """ Stop reason after `inst` at `adr` has run, or None """
+        access = self._accesses(inst)
+        if access:
+            return DebugStop(access[0], adr, cpu.en, access[1], access[2])
+        reg = self._writesCondition(inst)
+        if reg is not None:
+            v = cpu.register[reg]
+            for compare, value in self.conditions[reg]:
+                if compare(v, value):
+                    return DebugStop(B_REGISTER, adr, cpu.en, reg)
+        return None
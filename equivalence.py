@@ -0,0 +1,150 @@
+from simpleMachine import CPU, RunResult
+from peripherals import PerConsole
+from benchmark import programs, loadImage
+import asmInstructions as asm
+
+import argparse
+import random
+import sys
+import time
+
+OP_WEIGHTS = [1, 3, 6, 3, 4, 6, 1, 2, 2, 2, 2, 5, 1, 2, 2, 4]
+""" Relative frequency of each op code in random programs """
+
+def randomImage(rng: random.Random, size: int):
+    """ Random program of `size` bytes, biased towards jumps inside it, a few peripheral addresses and valid moves """
+    image = bytearray(0x100)
+    for adr in range(0, size, 2):
+        op = rng.choices(range(0x10), OP_WEIGHTS)[0]
+        reg = rng.randrange(0x10) if rng.random() < 0.5 else rng.randrange(4)
+        opr = rng.randrange(0x100)
+        if op == asm.MOVE:
+            reg = rng.randrange(4)
+            src = rng.randrange(3) if reg in (0x1, 0x3) else rng.randrange(0x10)
+            dest = rng.randrange(3) if reg in (0x2, 0x3) else rng.randrange(0x10)
+            opr = src << 4 | dest
+        elif op in (asm.JUMP, asm.JUMP_L) and rng.random() < 0.8:
+            opr = rng.randrange(0, size, 2)
+        elif op in (asm.STORE_P, asm.LOAD_P) and rng.random() < 0.7:
+            opr = rng.randrange(4)
+        image[adr] = op << 4 | reg
+        image[adr+1] = opr
+    return bytes(image)
+
+def countedLoop(rng: random.Random):
+    """ Program with a loop stepping a counter to a limit, the shape compiled code takes and `fastForward` summarizes.
+    Half of them modify their own code """
+    def inst(op: int, reg: int, opr: int):
+        return bytes((op << 4 | reg, opr))
+    loop = 0x0a
+    body = [
+        inst(asm.ADD_S, 0x1, 0x12),
+        inst(asm.LOAD, 0x4, rng.randrange(0x100)),
+        inst(asm.ADD_S, 0x5, 0x54), # fused with the LOAD
+        None,
+    ]
+    rng.shuffle(body)
+    # Store to a variable, or to the operand of the LOAD so the loop rewrites its own code
+    load = next(i for i, code in enumerate(body) if code and code[0] >> 4 == asm.LOAD)
+    body[body.index(None)] = inst(asm.STORE, 0x5, rng.choice((0xf0, loop + 2*load + 1)))
+    code = [
+        inst(asm.LOAD, 0x1, rng.randrange(0x100)), # counter
+        inst(asm.LOAD, 0x2, rng.choice((0x01, 0x01, 0xff, rng.randrange(0x100)))), # step
+        inst(asm.LOAD, 0x0, rng.randrange(0x100)), # limit
+        inst(asm.LOAD, 0x5, 0x00),
+        inst(asm.LOAD, 0x6, 0x2a),
+    ] + body
+    done = loop + 2 * (len(body) + 2)
+    code += [
+        inst(asm.JUMP, 0x1, done),
+        inst(asm.JUMP, 0x0, loop),
+        inst(asm.STORE_P, 0x6, 0x00), # print
+        inst(asm.MOVE, 0x2, 0x50 | asm.R_EXIT),
+        inst(asm.HALT, 0x0, 0x00),
+    ]
+    return b''.join(code)
+
+def runWhole(cpu: CPU, rng: random.Random, jit=False):
+    return cpu.run(jit=jit).reason
+
+def runSlices(cpu: CPU, rng: random.Random, jit=False):
+    """ Run in slices of random length, switching between the interpreter and compiled code when `jit` is set """
+    useJit = False
+    while True:
+        reason = cpu.run(rng.randrange(1, 0x20), useJit).reason
+        if reason != RunResult.BUDGET:
+            return reason
+        useJit = jit and rng.random() < 0.5
+
+modes = { # name: (runner, jit, fuse, fastForward, detectLoops)
+    'run': (runWhole, False, False, False, False),
+    'fused': (runWhole, False, True, False, False),
+    'forward': (runWhole, False, True, True, False),
+    'detect': (runWhole, False, True, False, True),
+    'jit': (runWhole, True, False, False, False),
+    'slices': (runSlices, False, True, True, False),
+    'jit slices': (runSlices, True, True, True, False),
+}
+
+def runImage(image: bytes, mxEn: int, inputs: dict[int, int], mode: str|None, seed: int):
+    """ Run an image to completion with `step()` when `mode` is None, else with the run mode.
+    Returns the final state and the `RunResult` reason, None for `step()` """
+    cpu = CPU()
+    console = PerConsole(0x00)
+    cpu.addPeripheral(console)
+    cpu.mxEn = mxEn
+    cpu.loadMemFromBytes(image)
+    for adr, v in inputs.items():
+        cpu.peripheral[adr] = v
+    error = None
+    reason = None
+    try:
+        if mode is None:
+            while cpu.step():
+                pass
+        else:
+            runner, jit, cpu.fuse, cpu.fastForward, cpu.detectLoops = modes[mode]
+            reason = runner(cpu, random.Random(seed), jit)
+    except Exception as e:
+        error = type(e).__name__
+    return (bytes(cpu.memory), bytes(cpu.register), bytes(cpu.peripheral), cpu.pgmi, cpu.en,
+            tuple(cpu.stack), cpu.exitCode, console.text, error), reason
+
+def check(cases: int = 500, seed: int = 1, selected: list[str]|None = None, verbose = True):
+    """ Run the repo programs and `cases` random programs in every mode and compare the final state, `en` included,
+    with stepping. A run stopped by `detectLoops` only has to match a step run that never stops.
+    Returns the number of mismatches """
+    rng = random.Random(seed)
+    images = [(filename, loadImage(filename), 0x10000) for filename in programs]
+    for i in range(cases):
+        if i % 4 == 0:
+            images.append((f'loop{i}', countedLoop(rng), rng.choice((0x100, 0x400, 0x10000))))
+        else:
+            images.append((f'random{i}', randomImage(rng, rng.choice((0x10, 0x20, 0x40, 0x80, 0x100))), rng.choice((0x40, 0x200, 0x1000))))
+    bad = 0
+    for name, image, mxEn in images:
+        inputs = {adr: rng.randrange(0x100) for adr in range(1, 4)}
+        expected, _ = runImage(image, mxEn, inputs, None, 0)
+        for mode in selected or modes:
+            got, reason = runImage(image, mxEn, inputs, mode, seed)
+            if reason == RunResult.LOOP and expected[4] >= mxEn and expected[8] is None:
+                continue
+            if got != expected:
+                bad += 1
+                if verbose:
+                    fields = ['memory', 'registers', 'peripherals', 'pgmi', 'en', 'stack', 'exitCode', 'output', 'error']
+                    diff = [f'{field} {a!r:.40} != {b!r:.40}' for field, a, b in zip(fields, got, expected) if a != b]
+                    print(f'{name} [{mode}] mxEn={mxEn} {image.hex()}: ' + ', '.join(diff))
+    return bad
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that every run mode ends in the same state, en included, as stepping')
+    parser.add_argument('-n', '--cases', type=int, default=500, help='random programs to run')
+    parser.add_argument('-s', '--seed', type=int, default=1)
+    parser.add_argument('-m', '--mode', action='append', choices=list(modes), default=None, help='run mode to check (repeatable, default all)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    bad = check(args.cases, args.seed, args.mode)
+    print(f'{args.cases + len(programs)} programs, {len(args.mode or modes)} modes, {bad} mismatches, {time.perf_counter() - start:.1f}s')
+    sys.exit(1 if bad else 0)
@@ -0,0 +1,224 @@
+from __future__ import annotations
+from simpleMachine import CPU, RunResult
+from peripherals import Peripheral, PerConsole
+from batchRunner import compileSource
+
+from collections import deque
+from typing import Iterable
+import argparse
+import hashlib
+import struct
+import time
+
+INPUTS = 'inputs'
+""" Path was cut off after reading `maxInputs` inputs """
+
+NODE_COST = 0x100
+""" Estimated Python overhead of a frontier entry, in bytes, on top of its packed state """
+VISIT_COST = 0x60
+""" Estimated size of a state digest in the visited set, in bytes """
+
+class PerChoice(Peripheral):
+    """ Input chosen by an `Explorer`. A load parks the CPU unless `value` is set, which is then read once """
+    legacy = False
+    def __init__(self, addr: int):
+        super().__init__(addr)
+        self.value: int|None = None
+
+    def onLoad(self, adr: int):
+        if not self.cpu: raise Exception('Must set CPU before loading from peripheral')
+        if self.value is None:
+            return False
+        self.cpu.peripheral[adr] = self.value
+        self.value = None
+
+    def quietUntil(self):
+        # Only acts on loads, and the value is used up by the first one
+        return None
+
+    def snapshot(self):
+        return self.value
+    def restore(self, state: int|None):
+        self.value = state
+    def saveState(self):
+        return b'' if self.value is None else bytes((self.value,))
+    def loadState(self, data: bytes):
+        self.value = data[0] if data else None
+    def copy(self):
+        return PerChoice(self.addr)
+
+    def clear(self):
+        self.value = None
+
+class Outcome:
+    """ A distinct way the program ends, with the first (shortest) input sequence found that leads to it """
+    def __init__(self, reason: str, exitCode: int, output: str, inputs: list[tuple[int, int]]):
+        self.reason = reason
+        self.exitCode = exitCode
+        self.output = output
+        self.inputs = inputs
+        """ (peripheral address, value) of every input read, in order """
+        self.hits = 1
+        """ Explored branches that ended this way """
+
+    def __str__(self):
+        inputs = ' '.join(f'p{adr:02x}={value:02x}' for adr, value in self.inputs) or 'no input'
+        return f'{self.reason}, exitCode={self.exitCode}, output={self.output!r}: {self.hits} branches, e.g. {inputs}'
+
+class Explorer:
+    """ Runs a program on every possible sequence of inputs. Each `LOAD_P` from an address in `inputs` forks the
+    machine once per value in `values`, breadth first, so the first input sequence found for each outcome is a shortest one.
+    Parked states are memoized by digest with the fewest cycles they were reached in, and a state seen before is only
+    followed again when reached in fewer cycles, as that leaves more of `maxCycles` to run. Frontier states are packed into
+    bytes; exploration stops adding states once the frontier and visited set would need more than `memoryCap` bytes.
+    With `distinctOutputs` off, states that differ only in console output are merged, so only the first output is reported """
+    def __init__(self, image: bytes, inputs: Iterable[int] = (0x01,), consoleAdr: int|None = 0x00, values: Iterable[int] = range(0x100),
+                 maxCycles: int = 0x10000, maxInputs: int|None = None, memoryCap: int = 1 << 26, distinctOutputs = True, detectLoops = True):
+        self.cpu = CPU()
+        self.console: PerConsole|None = None
+        if consoleAdr is not None:
+            self.console = PerConsole(consoleAdr)
+            self.cpu.addPeripheral(self.console)
+        self.choices: dict[int, PerChoice] = {}
+        """ Input address to its peripheral """
+        for adr in inputs:
+            self.choices[adr] = PerChoice(adr)
+            self.cpu.addPeripheral(self.choices[adr])
+        self.cpu.loadMemFromBytes(image)
+        self.cpu.mxEn = maxCycles
+        self.cpu.detectLoops = detectLoops
+        self.values = bytes(values)
+        self.maxInputs = maxInputs
+        self.memoryCap = memoryCap
+        self.distinctOutputs = distinctOutputs
+
+        self.outcomes: dict[tuple[str, int, str], Outcome] = {}
+        self.visited: dict[bytes, int] = {}
+        """ State digest to the lowest `en` it was reached at """
+        self.frontier: deque[tuple[int, bytes, str, bytes]] = deque()
+        """ Parked states to expand: (en, packed state, console output, inputs read as address, value pairs) """
+        self.used = 0
+        """ Estimated bytes held by the frontier and visited set """
+        self.branches = 0
+        """ Runs made, one per input value tried """
+        self.pruned = 0
+        """ Branches that reached a state already visited in as few cycles """
+        self.dropped = 0
+        """ States not followed because of `memoryCap` """
+        self.peak = 0
+        """ Largest frontier size """
+        self.elapsed = 0.0
+
+    @property
+    def complete(self):
+        """ Whether every reachable state within the cycle and input limits was explored """
+        return self.dropped == 0 and not self.frontier
+
+    def _pack(self):
+        cpu = self.cpu
+        return struct.pack('<Hh', cpu.pgmi, cpu.exitCode) + cpu.register + cpu.memory + cpu.peripheral + bytes(cpu.stack)
+
+    def _unpack(self, en: int, packed: bytes, output: str):
+        cpu = self.cpu
+        cpu.pgmi, cpu.exitCode = struct.unpack_from('<Hh', packed)
+        cpu.register[:] = packed[0x04:0x14]
+        memory = packed[0x14:0x114]
+        if cpu.memory != memory:
+            # Only drop decodes for the span that differs, usually a few variables
+            changed = [adr for adr in range(0x100) if cpu.memory[adr] != memory[adr]]
+            cpu.memory[:] = memory
+            cpu.invalidate(changed[0], changed[-1] + 1)
+        cpu.peripheral[:] = packed[0x114:0x214]
+        cpu.stack = list(packed[0x214:])
+        cpu.en = en
+        if self.console:
+            self.console.text = output
+
+    def _finish(self, result: RunResult, path: bytes):
+        output = self.console.text if self.console else ''
+        if result.reason != RunResult.WAIT:
+            self._record(result.reason, output, path)
+            return
+        if self.maxInputs is not None and len(path) >= 2 * self.maxInputs:
+            self._record(INPUTS, output, path)
+            return
+        packed = self._pack()
+        digest = hashlib.blake2b(packed, digest_size=16)
+        if self.distinctOutputs:
+            digest.update(output.encode('latin-1'))
+        key = digest.digest()
+        en = self.cpu.en
+        best = self.visited.get(key)
+        if best is not None and best <= en:
+            self.pruned += 1
+            return
+        cost = NODE_COST + len(packed) + len(output) + len(path)
+        if best is None:
+            cost += VISIT_COST
+        if self.used + cost > self.memoryCap:
+            self.dropped += 1
+            return
+        self.visited[key] = en
+        self.used += cost
+        self.frontier.append((en, packed, output, path))
+        self.peak = max(self.peak, len(self.frontier))
+
+    def _record(self, reason: str, output: str, path: bytes):
+        key = (reason, self.cpu.exitCode, output)
+        if key in self.outcomes:
+            self.outcomes[key].hits += 1
+        else:
+            self.outcomes[key] = Outcome(reason, self.cpu.exitCode, output, list(zip(path[::2], path[1::2])))
+
+    def run(self, maxStates: int|None = None):
+        """ Explore from the loaded image, or carry on from where the last call stopped, expanding up to `maxStates`
+        parked states. Returns the outcomes found so far """
+        start = time.perf_counter()
+        cpu = self.cpu
+        if self.branches == 0:
+            self.branches = 1
+            self._finish(cpu.run(), b'')
+        expanded = 0
+        while self.frontier and expanded != maxStates:
+            en, packed, output, path = self.frontier.popleft()
+            self.used -= NODE_COST + len(packed) + len(output) + len(path)
+            expanded += 1
+            adr = packed[0x14 + struct.unpack_from('<H', packed)[0] + 1] # LOAD_P operand of the parked instruction
+            choice = self.choices[adr]
+            for value in self.values:
+                self._unpack(en, packed, output)
+                choice.value = value
+                self.branches += 1
+                self._finish(cpu.run(), path + bytes((adr, value)))
+        self.elapsed += time.perf_counter() - start
+        return list(self.outcomes.values())
+
+    def report(self):
+        lines = [str(outcome) for outcome in sorted(self.outcomes.values(), key=lambda o: (len(o.inputs), o.reason, o.exitCode, o.output))]
+        status = 'complete' if self.complete else f'incomplete, {len(self.frontier)} states unexplored and {self.dropped} dropped'
+        lines.append(f'{len(self.outcomes)} outcomes, {len(self.visited)} states, {self.branches} branches, {self.pruned} pruned, '
+                     f'peak frontier {self.peak}, {self.elapsed:.3f}s, {status}')
+        return '\n'.join(lines)
+
+def _valueRange(s: str):
+    """ `start:end` (end exclusive) to a range of input values """
+    start, _, end = s.partition(':')
+    return range(int(start, 0), int(end, 0) if end else int(start, 0) + 1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a machine program on every possible input sequence and list how it can end')
+    parser.add_argument('file', help='.bin, .asm or .basic source')
+    parser.add_argument('-i', '--input', type=lambda s: int(s, 0), action='append', default=None, help='input peripheral address (repeatable, default 0x01)')
+    parser.add_argument('--console', type=lambda s: int(s, 0), default=0x00, help='console peripheral address')
+    parser.add_argument('-v', '--values', type=_valueRange, default=range(0x100), help='input values to try as start:end, default 0:256')
+    parser.add_argument('-c', '--max-cycles', type=int, default=0x10000, help='cycle limit per path')
+    parser.add_argument('-d', '--max-inputs', type=int, default=None, help='inputs read per path before it is cut off')
+    parser.add_argument('-s', '--max-states', type=int, default=None, help='parked states to expand')
+    parser.add_argument('-m', '--memory', type=int, default=64, help='memory cap for the frontier and visited set in MiB')
+    parser.add_argument('--merge-outputs', action='store_true', help='merge states that differ only in console output')
+    args = parser.parse_args()
+
+    explorer = Explorer(compileSource(args.file), args.input or [0x01], args.console, args.values, args.max_cycles,
+                        args.max_inputs, args.memory << 20, not args.merge_outputs)
+    explorer.run(args.max_states)
+    print(explorer.report())
@@ -0,0 +1,167 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import struct
+import sys
+
+import asmInstructions as asm
+
+if TYPE_CHECKING:
+    from simpleMachine import CPU
+
+ENTRY = struct.Struct('<IHBBBhIB')
+""" en, pgmi, destination kind, destination address, old value, exitCode, stack length, stack top """
+PER_ENTRY_COST = 0x60
+""" Estimated bytes of a peripheral log entry, on top of the size of its snapshot """
+
+J_NONE = 0
+J_REG = 1
+J_MEM = 2
+J_PER = 3
+
+# Cell overwritten by each op code. MOVE depends on its spec field and is handled separately.
+# pgmi, exitCode and the stack top are kept for every step
+_opDest = [
+    J_NONE, J_REG, J_REG, J_MEM,
+    None, J_REG, J_REG, J_REG,
+    J_REG, J_REG, J_REG, J_NONE,
+    J_NONE, J_PER, J_REG, J_NONE,
+]
+
+class Journal:
+    """ Undo journal for `CPU.stepBack()`. Each step keeps only the cell its instruction overwrites along with
+    pgmi, en, exitCode and the stack top, in a ring buffer. Peripherals are assumed to only change their own address;
+    their cell and `snapshot()` are logged when they change. Steps and peripheral entries together are kept within
+    `budget` bytes by dropping the oldest steps. Attach with `cpu.journal = journal` """
+    def __init__(self, budget: int = 0x100000):
+        self.budget = budget
+        self.capacity = max(budget // ENTRY.size, 1)
+        """ Steps that fit in the budget """
+        self._buf = bytearray(min(self.capacity, 0x400) * ENTRY.size)
+        """ Ring of entries, grown up to `capacity` entries as steps are recorded """
+        self._i = 0
+        """ Next entry slot """
+        self.count = 0
+        """ Steps that can be undone """
+        self._perLog: list[list[tuple]] = []
+        """ Per attached peripheral: (en, cell, snapshot, cost) before each step where either changed """
+        self._perBytes = 0
+        """ Estimated bytes held by `_perLog` """
+
+    def clear(self):
+        self._i = 0
+        self.count = 0
+        self._perLog = []
+        self._perBytes = 0
+
+    @property
+    def used(self):
+        """ Estimated bytes of the steps that can be undone and their peripheral entries """
+        return self.count * ENTRY.size + self._perBytes
+
+    def record(self, cpu: CPU, inst: int|None):
+        """ Called by `CPU.step()` after peripheral pre-updates and before the instruction `inst` (None if none runs) """
+        en = cpu.en - 1
+        kind = J_NONE
+        dest = old = 0
+        if inst is not None:
+            kind = _opDest[inst >> 12]
+            if kind == J_REG:
+                dest = (inst >> 8) & 0xf
+                old = cpu.register[dest]
+            elif kind is None: # MOVE
+                kind = J_NONE
+                if ((inst >> 8) & 0xf) < 2:
+                    kind = J_REG
+                    dest = inst & 0xf
+                    old = cpu.register[dest]
+            elif kind == J_MEM:
+                dest = inst & 0xff
+                old = cpu.memory[dest]
+            elif kind == J_PER:
+                dest = inst & 0xff
+                old = cpu.peripheral[dest]
+        stack = cpu.stack
+        if self._i * ENTRY.size == len(self._buf):
+            self._buf.extend(bytes(min(len(self._buf), (self.capacity - self._i) * ENTRY.size)))
+        ENTRY.pack_into(self._buf, self._i * ENTRY.size, en, cpu.pgmi, kind, dest, old, cpu.exitCode, len(stack), stack[-1] if stack else 0)
+        self._i += 1
+        if self._i == self.capacity:
+            self._i = 0
+        if self.count < self.capacity:
+            self.count += 1
+        elif self._i == 0:
+            self._trim()
+        if self._perBytes and self.used > self.budget:
+            self._evict()
+
+    def recordPeripherals(self, cpu: CPU):
+        """ Called by `CPU.step()` before peripheral pre-updates """
+        peripherals = cpu.peripherals
+        if len(self._perLog) != len(peripherals):
+            self._perLog = [[] for _ in peripherals]
+        en = cpu.en
+        for per, log in zip(peripherals, self._perLog):
+            cell = cpu.peripheral[per.addr]
+            snap = per.snapshot()
+            if not log or log[-1][1] != cell or log[-1][2] != snap:
+                cost = PER_ENTRY_COST + sys.getsizeof(snap)
+                log.append((en, cell, snap, cost))
+                self._perBytes += cost
+
+    def _evict(self):
+        """ Drop the oldest steps until the journal is back within `budget` """
+        while self.count and self.used > self.budget:
+            self.count -= max(min(self.count // 8, (self.used - self.budget) // ENTRY.size), 1)
+            self._trim()
+        if self.count == 0:
+            # Nothing left to undo, so only the current peripheral states are needed
+            for log in self._perLog:
+                self._perBytes -= sum(entry[3] for entry in log[:-1])
+                del log[:-1]
+
+    def _trim(self):
+        """ Drop peripheral entries older than the oldest step still in the ring """
+        if self.count == 0:
+            return
+        oldest = ENTRY.unpack_from(self._buf, (self._i - self.count) % self.capacity * ENTRY.size)[0]
+        for log in self._perLog:
+            n = 0
+            while n + 1 < len(log) and log[n+1][0] <= oldest:
+                n += 1
+            self._perBytes -= sum(entry[3] for entry in log[:n])
+            del log[:n]
+
+    def undo(self, cpu: CPU):
+        """ Undo the last recorded step. Returns False if there is none """
+        if self.count == 0:
+            return False
+        self._i = (self._i - 1) % self.capacity
+        self.count -= 1
+        en, pgmi, kind, dest, old, exitCode, stackLen, stackTop = ENTRY.unpack_from(self._buf, self._i * ENTRY.size)
+        if kind == J_REG:
+            cpu.register[dest] = old
+        elif kind == J_MEM:
+            cpu._restoreMemory(dest, old)
+        elif kind == J_PER:
+            cpu.peripheral[dest] = old
+        for per, log in zip(cpu.peripherals, self._perLog):
+            if not log:
+                continue
+            _, cell, snap, cost = log[-1]
+            cpu.peripheral[per.addr] = cell
+            per.restore(snap)
+            if log[-1][0] == en:
+                log.pop()
+                self._perBytes -= cost
+        cpu.pgmi = pgmi
+        cpu.en = en
+        cpu._parkedTick = None
+        cpu.exitCode = exitCode
+        stack = cpu.stack
+        # An instruction pops and pushes at most once, so only the top can differ
+        if stackLen == 0:
+            stack.clear()
+        else:
+            del stack[stackLen-1:]
+            stack.append(stackTop)
+        return True
@@ -1,4 +1,6 @@
-from simpleMachine import CPU
+from simpleMachine import CPU, RunResult
+from debugger import Debugger, WRITE
+from journal import Journal
 import asmCompile as asm
 from basicCompile import BasicProgram
 import convert
@@ -12,6 +14,7 @@ import time
 import traceback
 
 cpu = CPU()
+cpu.journal = Journal()
 
 # cpu.instToMem([
 #     0x1402,
@@ -78,7 +81,7 @@ pgmCtrLabel.pack()
 
 cInstFrame = tk.LabelFrame(instFrame, text="Instruction")
 cInstFrame.pack(side=tk.LEFT)
-cInst = int.from_bytes(b''.join([cpu.memory[cpu.pgmi],cpu.memory[cpu.pgmi+1]]), byteorder="big")
+cInst = (cpu.memory[cpu.pgmi] << 8) | cpu.memory[cpu.pgmi+1]
 cInstLabel = tk.Label(cInstFrame, text=f'0x{convert.toHex(cInst,4)}', font=memFont)
 cInstLabel.pack(side=tk.LEFT)
 cInstDLabel = tk.Label(cpuFrame, text=strInstr(cInst), font=memFont, width=40)
@@ -118,7 +121,7 @@ for i in range(-1,memR):
             if j >= 0:
                 mAdr = j + (i*memC)
                 # print(f'Making mem {convert.toHex(mAdr,2)}')
-                memLabels[mAdr] = tk.Label(f, text=convert.toHex(int.from_bytes(cpu.memory[mAdr], "big"),2), font=memFont)
+                memLabels[mAdr] = tk.Label(f, text=convert.toHex(cpu.memory[mAdr],2), font=memFont)
                 memLabels[mAdr].pack(side=tk.LEFT)
             else:
                 l = tk.Label(f, text=f'{convert.toHex(i,1)}', font=memFont)
@@ -140,7 +143,7 @@ def updateMem():
                 # print('j',j)
                 mAdr = j + (i*memC)
                 # print(f'Updating mem {convert.toHex(mAdr,2)}')
-                memLabels[mAdr].configure(text=convert.toHex(int.from_bytes(cpu.memory[mAdr], "big"),2))
+                memLabels[mAdr].configure(text=convert.toHex(cpu.memory[mAdr],2))
 
 perFrame = tk.LabelFrame(memPerFrame, text="Peripherals")
 perFrame.pack(side=tk.RIGHT, padx = 5, pady = 5)
@@ -155,7 +158,7 @@ for i in range(-1,perR):
             if j >= 0:
                 mAdr = j + (i*perC)
                 # print(f'Making mem {convert.toHex(mAdr,2)}')
-                perLabels[mAdr] = tk.Label(f, text=convert.toHex(int.from_bytes(cpu.peripheral[mAdr], "big"),2), font=memFont)
+                perLabels[mAdr] = tk.Label(f, text=convert.toHex(cpu.peripheral[mAdr],2), font=memFont)
                 perLabels[mAdr].pack(side=tk.LEFT)
             else:
                 l = tk.Label(f, text=f'{convert.toHex(i,1)}', font=memFont)
@@ -180,28 +183,28 @@ def updatePer():
     for i in range(0,perR):
         for j in range(0,perC):
                 mAdr = j + (i*perC)
-                perLabels[mAdr].configure(text=convert.toHex(int.from_bytes(cpu.peripheral[mAdr], "big"),2))
+                perLabels[mAdr].configure(text=convert.toHex(cpu.peripheral[mAdr],2))
 
 regFrame = tk.LabelFrame(cpuFrame, text='Registers')
 regFrame.pack(side=tk.BOTTOM)
 regLabels = {}
 for i in range(0,0x10):
-    l = tk.Label(regFrame, text=convert.toHex(int.from_bytes(cpu.register[i], "big"),2), font=memFont)
+    l = tk.Label(regFrame, text=convert.toHex(cpu.register[i],2), font=memFont)
     l.pack(side=tk.LEFT)
     regLabels[i] = l
 
 def updateReg():
     for i in range(0,0x10):
-        regLabels[i].configure(text=convert.toHex(int.from_bytes(cpu.register[i], "big"),2))
+        regLabels[i].configure(text=convert.toHex(cpu.register[i],2))
 
 def update():
     if cpu.pgmi < 0xff:
-        cInst = int.from_bytes(b''.join([cpu.memory[cpu.pgmi],cpu.memory[cpu.pgmi+1]]), byteorder="big")
+        cInst = (cpu.memory[cpu.pgmi] << 8) | cpu.memory[cpu.pgmi+1]
         pgmCtrLabel.configure(text=f'0x{convert.toHex(cpu.pgmi,2)}')
         cInstLabel.configure(text=f'0x{convert.toHex(cInst,4)}')
         cInstDLabel.configure(text=strInstr(cInst))
     
-    if len(cpu.stack) > 0: stackLabel.configure(text=f'0x{convert.toHex(int.from_bytes(cpu.stack[-1],"big"))}@{len(cpu.stack)}')
+    if len(cpu.stack) > 0: stackLabel.configure(text=f'0x{convert.toHex(cpu.stack[-1])}@{len(cpu.stack)}')
     else: stackLabel.configure(text=f'0x00@-')
     exitCodeLabel.configure(text=str(cpu.exitCode))
     
@@ -216,6 +219,11 @@ def step():
     update()
     return c
 
+def stepBack():
+    if not cpu.stepBack():
+        print('Nothing to step back to')
+    update()
+
 run = False
 speed = 0.5
 
@@ -267,6 +275,8 @@ def stopRun():
     global run
     run = False
 
+backButton = tk.Button(runFrame, text='Back', command=stepBack)
+backButton.pack(side=tk.LEFT)
 stepButton = tk.Button(runFrame, text='Step', command=step)
 stepButton.pack(side=tk.LEFT)
 
@@ -311,6 +321,63 @@ fastButton.pack(side=tk.LEFT)
 fastButton = tk.Button(speedFrame, text='Very Fast', command=runVeryFast)
 fastButton.pack(side=tk.LEFT)
 
+debugger = Debugger()
+cpu.debugger = debugger
+
+debugFrame = tk.LabelFrame(upperLeftFrame, text='Debug')
+debugFrame.pack(side=tk.TOP)
+
+debugCtrlFrame = tk.Frame(debugFrame)
+debugCtrlFrame.pack()
+debugInput = tk.Entry(debugCtrlFrame, width = 6)
+debugInput.insert(0, '00')
+debugInput.pack(side=tk.LEFT)
+debugLabel = tk.Label(debugFrame, text='', font=("Consolas", 10), width=40)
+debugLabel.pack()
+
+def debugAdr():
+    try:
+        adr = int(debugInput.get(), 16)
+    except ValueError:
+        adr = -1
+    if adr < 0 or adr > 0xff:
+        debugLabel.configure(text=f'Invalid address "{debugInput.get()}"')
+        return None
+    return adr
+
+def addBreakpoint():
+    adr = debugAdr()
+    if adr is None: return
+    debugger.addBreakpoint(adr)
+    debugLabel.configure(text=f'Breakpoint at i{convert.toHex(adr,2)}')
+
+def addWatch():
+    adr = debugAdr()
+    if adr is None: return
+    debugger.watchMemory(adr, WRITE)
+    debugLabel.configure(text=f'Watching writes to m{convert.toHex(adr,2)}')
+
+def clearDebug():
+    debugger.clear()
+    debugLabel.configure(text='Cleared')
+
+def continueRun():
+    result = cpu.run()
+    if result.reason == RunResult.BREAK:
+        debugLabel.configure(text=str(debugger.lastStop))
+    else:
+        debugLabel.configure(text=f'Stopped: {result.reason}')
+    update()
+
+breakButton = tk.Button(debugCtrlFrame, text='Break', command=addBreakpoint)
+breakButton.pack(side=tk.LEFT)
+watchButton = tk.Button(debugCtrlFrame, text='Watch', command=addWatch)
+watchButton.pack(side=tk.LEFT)
+clearButton = tk.Button(debugCtrlFrame, text='Clear', command=clearDebug)
+clearButton.pack(side=tk.LEFT)
+continueButton = tk.Button(debugCtrlFrame, text='Continue', command=continueRun)
+continueButton.pack(side=tk.LEFT)
+
 fileFrame = tk.LabelFrame(upperRightFrame, text='File')
 fileFrame.pack()
 
@@ -0,0 +1,105 @@
+from fractions import Fraction
+import bisect
+import math
+import sys
+
+# 8-bit float used by ADD_F: 1 sign bit, 4 exponent bits (bias 7) and 3 mantissa bits, IEEE 754 style.
+# Exponent 0 holds zero and subnormals, exponent 0xF infinities (mantissa 0) and NaN; results are rounded to nearest, ties to even
+EXP_BITS = 4
+MAN_BITS = 3
+BIAS = 7
+SIGN = 0x80
+INF = 0x78
+""" Positive infinity; negative infinity is `SIGN | INF` """
+NAN = 0x7F
+""" NaN produced by ADD_F """
+MAX = 0x77
+""" Largest finite value, 240.0 """
+
+def isNaN(b: int):
+    return (b & 0x7f) > INF
+
+def toFloat(b: int):
+    """ Value of the minifloat byte `b` """
+    sign = -1.0 if b & SIGN else 1.0
+    exp = (b >> MAN_BITS) & 0xf
+    man = b & 0x7
+    if exp == 0xf:
+        return sign * math.inf if man == 0 else math.nan
+    if exp == 0:
+        return sign * math.ldexp(man, 1 - BIAS - MAN_BITS)
+    return sign * math.ldexp(8 + man, exp - BIAS - MAN_BITS)
+
+def fromFloat(x: float):
+    """ Nearest minifloat byte to `x`, ties to even. Values beyond the largest finite value round to infinity """
+    if x != x:
+        return NAN
+    sign = SIGN if math.copysign(1.0, x) < 0 else 0
+    x = abs(x)
+    if x == math.inf:
+        return sign | INF
+    if x == 0:
+        return sign
+    m, e = math.frexp(x) # x = m * 2**e with 0.5 <= m < 1
+    exp = e - 1 + BIAS
+    if exp < 1: # subnormal; may round up into the smallest normal, which the bits carry over to
+        return sign | round(math.ldexp(x, BIAS - 1 + MAN_BITS))
+    man = round(m * 16) # 8 to 16 with the hidden bit
+    if man == 16:
+        man = 8
+        exp += 1
+    if exp >= 0xf:
+        return sign | INF
+    return sign | (exp << MAN_BITS) | (man - 8)
+
+def add(a: int, b: int):
+    """ ADD_F of two minifloat bytes. The sum of two minifloats is exact as a Python float, so this rounds once """
+    return fromFloat(toFloat(a) + toFloat(b))
+
+_addTable: bytes|None = None
+
+def addTable():
+    """ ADD_F results indexed by `(a << 8) | b`; built on first use and shared by every CPU """
+    global _addTable
+    if _addTable is None:
+        values = [toFloat(b) for b in range(0x100)]
+        _addTable = bytes(fromFloat(x + y) for x in values for y in values)
+    return _addTable
+
+def _refAdd(a: int, b: int, finite: list[tuple[Fraction, int]]):
+    """ Reference model: exact rational sum rounded to the nearest of the sorted `finite` (value, byte) pairs """
+    x, y = toFloat(a), toFloat(b)
+    if math.isnan(x) or math.isnan(y) or (math.isinf(x) and math.isinf(y) and x != y):
+        return NAN
+    if math.isinf(x) or math.isinf(y):
+        return fromFloat(x if math.isinf(x) else y)
+    exact = Fraction(x) + Fraction(y)
+    if exact == 0:
+        # -0 only when both are -0
+        return SIGN if (a == SIGN and b == SIGN) else 0
+    limit = Fraction(toFloat(MAX)) + Fraction(toFloat(MAX) - toFloat(MAX - 1)) / 2
+    if abs(exact) >= limit:
+        return (SIGN if exact < 0 else 0) | INF
+    i = bisect.bisect_left(finite, (exact, -1))
+    best = None
+    for value, c in finite[max(i-1, 0):i+1]:
+        d = abs(value - exact)
+        if best is None or d < best[0] or (d == best[0] and c & 1 == 0):
+            best = (d, c)
+    return best[1]
+
+if __name__ == '__main__':
+    # Check every ADD_F table entry against the reference model
+    table = addTable()
+    finite = sorted((Fraction(toFloat(c)), c) for c in range(0x100) if (c >> MAN_BITS) & 0xf != 0xf and c != SIGN)
+    bad = 0
+    for a in range(0x100):
+        for b in range(0x100):
+            got = table[(a << 8) | b]
+            want = _refAdd(a, b, finite)
+            if got != want and not (isNaN(got) and isNaN(want)):
+                bad += 1
+                if bad <= 10:
+                    print(f'{a:02x} + {b:02x}: table {got:02x}, reference {want:02x} ({toFloat(a)} + {toFloat(b)})')
+    print(f'{0x10000 - bad} of 65536 sums match the reference')
+    sys.exit(1 if bad else 0)
@@ -1,6 +1,10 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 from abc import ABC, abstractmethod
+from collections import deque
+from typing import Iterable
+import asyncio
+import copy
 
 import tkinter as tk
 import scrollableFrame as sF
@@ -10,44 +14,166 @@ if TYPE_CHECKING:
 
 class Peripheral(ABC):
     """ Generic CPU peripheral """
+    legacy = True
+    """ Have the CPU call `preUpdate()` before and `update()` after every cycle. Bus peripherals set this False
+    and are only called on `STORE_P`/`LOAD_P` to the addresses in `ranges()` and every `clockDivider` cycles """
+    clockDivider: int|None = None
+    """ Have the CPU call `tick()` on every cycle that is a multiple of this """
+    
     def __init__(self, addr: int):
         self.cpu: CPU|None = None
         self.addr = addr
     
-    @abstractmethod
+    def ranges(self) -> list[tuple[int, int]]:
+        """ Peripheral address ranges (start, end exclusive) this peripheral owns on the bus """
+        return [(self.addr, self.addr + 1)]
+    
+    def onStore(self, adr: int, value: int):
+        """ `STORE_P` wrote `value` to owned address `adr` """
+        pass
+    def onLoad(self, adr: int):
+        """ `LOAD_P` is about to read owned address `adr`; update peripheral memory here.
+        Return False to park the CPU on the load until `ready()` completes """
+        pass
+    async def ready(self):
+        """ Awaited by `CPU.runAsync()` while a load is parked on this peripheral """
+        await asyncio.sleep(0)
+    def tick(self):
+        pass
+    
     def preUpdate(self):
         pass
-    @abstractmethod
     def update(self):
         pass
     @abstractmethod
     def clear(self):
         pass
+    
+    def quietUntil(self) -> int|None:
+        """ Cycle from which this peripheral may change peripheral memory or its own state other than on a
+        `STORE_P`; None if never. The CPU can fast-forward idle loops up to that point """
+        if not self.cpu: raise Exception('Must set CPU before checking peripheral')
+        return self.cpu.en
+    
+    def snapshot(self):
+        """ State to keep in a CPU snapshot, beyond what is in peripheral memory """
+        return None
+    def restore(self, state):
+        pass
+    def saveState(self):
+        """ `snapshot()` as bytes for a checkpoint file """
+        return b''
+    def loadState(self, data: bytes):
+        """ Restore the state from `saveState()` """
+        pass
+    def copy(self):
+        """ Unattached copy for a forked CPU """
+        per = copy.copy(self)
+        per.cpu = None
+        return per
 
 class PerConsole(Peripheral):
-    """ Peripheral Console """
+    """ Peripheral Console. Prints every non-zero value stored to its address, which always reads as 0 """
+    legacy = False
     def __init__(self, addr: int):
         super().__init__(addr)
         self.text = ''
+        self.textLabel: tk.Label|None = None
     
     def setGUI(self, frame: tk.Misc):
         self.frame = sF.VerticalScrolledFrame(frame, width=50, height=10)
         self.textLabel = tk.Label(frame, text='', font=("Consolas", 10), width=50, height=10, anchor=tk.NW, justify=tk.LEFT)
         self.textLabel.pack()
     
-    def preUpdate(self):
-        if not self.cpu: raise Exception('Must set CPU before pre-updating peripheral')
-        self.cpu.peripheral[self.addr] = bytes(0x00)
-    
-    def update(self):
-        if not self.cpu: raise Exception('Must set CPU before updating peripheral')
-        v = int.from_bytes(self.cpu.peripheral[self.addr], "big")
-        if(v > 0x00):
-            self.text += chr(v)
+    def onStore(self, adr: int, value: int):
+        if(value > 0x00):
+            self.text += chr(value)
             if(self.textLabel):
                 self.textLabel.configure(text=self.text)
     
+    def onLoad(self, adr: int):
+        if not self.cpu: raise Exception('Must set CPU before loading from peripheral')
+        self.cpu.peripheral[adr] = 0x00
+    
+    def quietUntil(self):
+        # Only acts on what the CPU writes to it
+        return None
+    
+    def snapshot(self):
+        return self.text
+    def restore(self, state: str):
+        self.text = state
+        if(self.textLabel):
+            self.textLabel.configure(text=self.text)
+    def saveState(self):
+        # Only byte values are ever printed
+        return self.text.encode('latin-1')
+    def loadState(self, data: bytes):
+        self.restore(data.decode('latin-1'))
+    def copy(self):
+        per = PerConsole(self.addr)
+        per.text = self.text
+        return per
+    
     def clear(self):
         self.text = ''
         if(self.textLabel):
-            self.textLabel.configure(text=self.text)
\ No newline at end of file
+            self.textLabel.configure(text=self.text)
+
+class PerInput(Peripheral):
+    """ Peripheral Input. Each load from its address reads the next byte given to `feed()`, e.g. from a socket.
+    With nothing queued the load parks the CPU until more input arrives, or reads 0 when `block` is False
+    or the input was closed """
+    legacy = False
+    def __init__(self, addr: int, block = True):
+        super().__init__(addr)
+        self.block = block
+        self.closed = False
+        """ No more input will be fed, e.g. the socket was disconnected """
+        self.queue: deque[int] = deque()
+        self._fed = asyncio.Event()
+    
+    def feed(self, data: bytes|Iterable[int]):
+        self.queue.extend(data)
+        if self.queue:
+            self._fed.set()
+    
+    def close(self):
+        """ End of input: loads read what is still queued, then 0, and a parked CPU is released """
+        self.closed = True
+        self._fed.set()
+    
+    def onLoad(self, adr: int):
+        if not self.cpu: raise Exception('Must set CPU before loading from peripheral')
+        if self.queue:
+            self.cpu.peripheral[adr] = self.queue.popleft()
+        elif self.block and not self.closed:
+            self._fed.clear()
+            return False
+        else:
+            self.cpu.peripheral[adr] = 0x00
+    
+    async def ready(self):
+        await self._fed.wait()
+    
+    def snapshot(self):
+        return tuple(self.queue)
+    def restore(self, state: tuple[int, ...]):
+        self.queue = deque(state)
+        if self.queue:
+            self._fed.set()
+    def saveState(self):
+        return bytes(self.queue)
+    def loadState(self, data: bytes):
+        self.restore(tuple(data))
+    def copy(self):
+        per = PerInput(self.addr, self.block)
+        per.feed(self.queue)
+        if self.closed:
+            per.close()
+        return per
+    
+    def clear(self):
+        self.queue.clear()
+        self.closed = False
+        self._fed.clear()
@@ -0,0 +1,115 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import random
+import sys
+
+import asmInstructions as asm
+from convert import toHex
+
+if TYPE_CHECKING:
+    from simpleMachine import CPU
+
+class Profiler:
+    """ Counts cycles per op code and per instruction address. Attach with `cpu.profiler = profiler`.
+    With `every` at 1 every executed instruction is counted exactly. Above 1, `CPU.run()` stops about every `every`
+    cycles and charges the cycles since the last sample to the instruction about to execute, leaving the fast run loop
+    in between. The period is jittered by up to half either way from a `seed`ed generator, so a loop whose length
+    divides `every` is not always sampled at the same instruction """
+    def __init__(self, every: int = 1, seed: int = 0):
+        self.every = every
+        self.seed = seed
+        self._rng = random.Random(seed)
+        self._skip = 0
+        self._next = self.interval()
+        """ Instructions `record()` counts before taking the next sample """
+        self.opCycles = [0] * 0x10
+        """ Cycles per op code """
+        self.adrCycles = [0] * 0x100
+        """ Cycles per instruction address """
+        self.adrInst: list[int|None] = [None] * 0x100
+        """ Last instruction seen at each address """
+        self.samples = 0
+
+    def record(self, adr: int, inst: int):
+        """ Count an instruction the CPU just executed """
+        weight = 1
+        if self.every > 1:
+            self._skip += 1
+            if self._skip < self._next:
+                return
+            weight = self._skip
+            self._skip = 0
+            self._next = self.interval()
+        self.opCycles[inst >> 12] += weight
+        self.adrCycles[adr] += weight
+        self.adrInst[adr] = inst
+        self.samples += 1
+
+    def interval(self):
+        """ Cycles until the next sample: `every` plus or minus up to half of it """
+        if self.every <= 1:
+            return 1
+        half = self.every // 2
+        return self.every + self._rng.randint(-half, half)
+
+    def sample(self, cpu: CPU, cycles: int):
+        """ Charge `cycles` cycles to the instruction at the CPU's program index """
+        adr = cpu.pgmi
+        if adr >= 0xff:
+            return
+        inst = (cpu.memory[adr] << 8) | cpu.memory[adr+1]
+        self.opCycles[inst >> 12] += cycles
+        self.adrCycles[adr] += cycles
+        self.adrInst[adr] = inst
+        self.samples += 1
+
+    def clear(self):
+        self._rng = random.Random(self.seed)
+        self._skip = 0
+        self._next = self.interval()
+        self.opCycles = [0] * 0x10
+        self.adrCycles = [0] * 0x100
+        self.adrInst = [None] * 0x100
+        self.samples = 0
+
+    def total(self):
+        return sum(self.adrCycles)
+
+    def hotSpots(self):
+        """ (address, cycles, instruction) of every address that was executed, most cycles first """
+        spots = [(adr, n, self.adrInst[adr]) for adr, n in enumerate(self.adrCycles) if n]
+        spots.sort(key=lambda spot: spot[1], reverse=True)
+        return spots
+
+    def hotOps(self):
+        """ (op code, cycles) of every op code that was executed, most cycles first """
+        ops = [(op, n) for op, n in enumerate(self.opCycles) if n]
+        ops.sort(key=lambda op: op[1], reverse=True)
+        return ops
+
+    def report(self, top: int = 20):
+        """ Hot-spot report: the `top` addresses by cycles with their disassembly, then cycles per op code """
+        total = self.total() or 1
+        mode = 'exact' if self.every == 1 else f'sampled every {self.every} cycles'
+        lines = [f'{self.total()} cycles ({mode})', '', ' adr      cycles      %  instruction']
+        for adr, n, inst in self.hotSpots()[:top]:
+            lines.append(f'  {toHex(adr,2)} {n:>11} {n*100/total:>6.2f}  {asm.strInstr(inst)}')
+        lines += ['', ' op           cycles      %']
+        for op, n in self.hotOps():
+            lines.append(f' {asm.toName(op):<9} {n:>9} {n*100/total:>6.2f}')
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.report()
+
+if __name__ == '__main__':
+    # Profile a program: profiler.py FILE [every]
+    from simpleMachine import CPU
+    from peripherals import PerConsole
+    from batchRunner import compileSource
+    cpu = CPU()
+    cpu.addPeripheral(PerConsole(0x00))
+    cpu.loadMemFromBytes(compileSource(sys.argv[1]))
+    cpu.profiler = Profiler(int(sys.argv[2]) if len(sys.argv) > 2 else 1)
+    print(cpu.run())
+    print(cpu.profiler.report())
@@ -0,0 +1,148 @@
+from __future__ import annotations
+from simpleMachine import CPU, RunResult
+from batchRunner import TIMEOUT, compileSource
+from peripherals import PerConsole
+
+import argparse
+import time
+
+HIGH = 4
+NORMAL = 2
+LOW = 1
+""" Priority classes; a job gets this many quanta per round """
+
+READY = 'ready'
+PAUSED = 'paused'
+WAITING = 'waiting'
+""" Parked on a peripheral load; retried every round """
+DONE = 'done'
+
+class Job:
+    """ A CPU owned by a `Scheduler` along with its budgets and accounting """
+    def __init__(self, cpu: CPU, name: str, priority: int, maxCycles: int|None, timeout: float|None):
+        self.cpu = cpu
+        self.name = name
+        self.priority = priority
+        self.maxCycles = maxCycles
+        """ Cycle budget for the job """
+        self.timeout = timeout
+        """ Wall-time budget in seconds, counting only time spent running """
+        self.state = READY
+        self.startEn = cpu.en
+        self.elapsed = 0.0
+        """ Wall time spent running so far """
+        self.quanta = 0
+        """ Quanta run so far """
+        self.result: RunResult|None = None
+        """ Final result once the job is done """
+
+    @property
+    def cycles(self):
+        """ Cycles run so far """
+        return self.cpu.en - self.startEn
+
+    def stats(self):
+        return {'name': self.name, 'state': self.state, 'priority': self.priority, 'cycles': self.cycles, 'elapsed': self.elapsed,
+                'quanta': self.quanta, 'reason': self.result.reason if self.result else None, 'exitCode': self.cpu.exitCode}
+
+    def __str__(self):
+        reason = f' {self.result.reason}' if self.result else ''
+        return f'{self.name}: {self.state}{reason}, {self.cycles} cycles, {self.elapsed*1000:.3f}ms, {self.quanta} quanta'
+
+class Scheduler:
+    """ Runs many CPUs in one thread, round-robin in quanta of `quantum` cycles. Each round a job runs as many
+    quanta as its priority class, so long programs can not starve the rest. A job ends on any run result other
+    than `RunResult.BUDGET` or when its cycle or wall-time budget is used up; a paused job keeps its state """
+    def __init__(self, quantum: int = 0x1000, jit=False):
+        self.quantum = quantum
+        self.jit = jit
+        self.jobs: list[Job] = []
+
+    def add(self, cpu: CPU, name: str|None = None, priority: int = NORMAL, maxCycles: int|None = None, timeout: float|None = None):
+        job = Job(cpu, name or f'cpu{len(self.jobs)}', priority, maxCycles, timeout)
+        self.jobs.append(job)
+        return job
+
+    def remove(self, job: Job):
+        self.jobs.remove(job)
+
+    def pause(self, job: Job):
+        """ Stop scheduling `job` until `resume()`. Takes effect between quanta, so the CPU state is kept as is """
+        if job.state != DONE:
+            job.state = PAUSED
+
+    def resume(self, job: Job):
+        if job.state == PAUSED:
+            job.state = READY
+
+    def active(self):
+        """ Jobs that are ready or waiting """
+        return [job for job in self.jobs if job.state in (READY, WAITING)]
+
+    def runRound(self):
+        """ Give every ready or waiting job its quanta. Returns False once no job is left ready """
+        for job in self.active():
+            for _ in range(job.priority):
+                if job.state not in (READY, WAITING) or not self._runQuantum(job):
+                    break
+        return any(job.state == READY for job in self.jobs)
+
+    def _runQuantum(self, job: Job):
+        """ Run one quantum of `job`. Returns False if it should not get another this round """
+        n = self.quantum
+        if job.maxCycles is not None:
+            n = min(n, job.maxCycles - job.cycles)
+        result = job.cpu.run(n, self.jit)
+        job.elapsed += result.elapsed
+        job.quanta += 1
+        if result.reason == RunResult.WAIT:
+            job.state = WAITING
+            return False
+        job.state = READY
+        reason = result.reason
+        if reason == RunResult.BUDGET:
+            if job.timeout is not None and job.elapsed >= job.timeout:
+                reason = TIMEOUT
+            elif job.maxCycles is None or job.cycles < job.maxCycles:
+                return True
+        job.state = DONE
+        job.result = RunResult(reason, job.cpu.exitCode, job.cycles, job.elapsed)
+        if reason == RunResult.LOOP:
+            job.result.loopEntry, job.result.loopPeriod = result.loopEntry, result.loopPeriod
+        return False
+
+    def run(self, maxRounds: int|None = None):
+        """ Run rounds until no job is ready, or for `maxRounds` rounds. Jobs waiting on input are left waiting """
+        rounds = 0
+        while rounds != maxRounds and self.runRound():
+            rounds += 1
+        return rounds
+
+    def stats(self):
+        """ Accounting of every job as dicts; valid between quanta """
+        return [job.stats() for job in self.jobs]
+
+    def report(self):
+        return '\n'.join(str(job) for job in self.jobs)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run machine programs together on one thread, round-robin')
+    parser.add_argument('files', nargs='+', help='.bin, .asm or .basic sources; suffix with :high or :low to change priority')
+    parser.add_argument('-q', '--quantum', type=int, default=0x1000, help='cycles per quantum')
+    parser.add_argument('-c', '--max-cycles', type=int, default=None, help='cycle budget per machine')
+    parser.add_argument('-t', '--timeout', type=float, default=None, help='wall-time budget per machine in seconds')
+    parser.add_argument('--jit', action='store_true', help='run compiled code')
+    args = parser.parse_args()
+
+    priorities = {'high': HIGH, 'normal': NORMAL, 'low': LOW}
+    scheduler = Scheduler(args.quantum, args.jit)
+    for spec in args.files:
+        file, _, priority = spec.partition(':')
+        cpu = CPU()
+        cpu.addPeripheral(PerConsole(0x00))
+        cpu.loadMemFromBytes(compileSource(file))
+        scheduler.add(cpu, file, priorities[priority or 'normal'], args.max_cycles, args.timeout)
+    start = time.perf_counter()
+    scheduler.run()
+    print(scheduler.report())
+    print(f'{time.perf_counter() - start:.3f}s')
@@ -0,0 +1,56 @@
+from asyncRunner import runSession
+from simpleMachine import RunResult
+import asmInstructions as asm
+
+import argparse
+import asyncio
+import sys
+
+def readLine(inputAdr = 0x01):
+    """ Program that reads input until a newline or 0, then halts """
+    code = [
+        (asm.LOAD, 0x2, 0x0a),
+        (asm.LOAD, 0x0, 0x00), # 0x02
+        (asm.LOAD_P, 0x1, inputAdr),
+        (asm.JUMP, 0x1, 0x10), # 0 read
+        (asm.MOVE, 0x0, 0x20),
+        (asm.JUMP, 0x1, 0x10), # newline read
+        (asm.JUMP, 0x0, 0x02),
+        (asm.NO_OP, 0x0, 0x00),
+        (asm.HALT, 0x0, 0x00), # 0x10
+    ]
+    return b''.join(bytes((op << 4 | reg, opr)) for op, reg, opr in code)
+
+async def check(sessions: int = 8, timeout: float = 5.0):
+    """ Connect `sessions` clients that send part of a line and disconnect. Returns the number of sessions still running
+    after `timeout` seconds, which would leak their CPU, task and socket """
+    image = readLine()
+    results: list[RunResult] = []
+    async def session(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        results.append(await runSession(image, reader, writer))
+    server = await asyncio.start_server(session, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        for i in range(sessions):
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'partial'[:i])
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        loop = asyncio.get_running_loop()
+        end = loop.time() + timeout
+        while len(results) < sessions and loop.time() < end:
+            await asyncio.sleep(0.01)
+    for result in results:
+        print(result)
+    return sessions - len(results)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that served sessions end when their client disconnects mid-input')
+    parser.add_argument('-n', '--sessions', type=int, default=8)
+    parser.add_argument('-t', '--timeout', type=float, default=5.0, help='seconds to wait for sessions to end')
+    args = parser.parse_args()
+
+    running = asyncio.run(check(args.sessions, args.timeout))
+    print(f'{args.sessions} sessions, {running} still running')
+    sys.exit(1 if running else 0)
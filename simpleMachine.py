@@ -1,7 +1,20 @@
 import convert
 from peripherals import Peripheral
+from blockJit import BlockJit
+from traceRecorder import TraceRecorder
+from profiler import Profiler
+from journal import Journal
+from debugger import Debugger, DebugStop, B_BREAK
+from minifloat import addTable
 import asmInstructions as asm
 
+import asyncio
+import mmap
+import os
+import random
+import struct
+import time
+
 # def dump():
 #     dumpA(8,32)
 
@@ -68,163 +81,1004 @@ def instNameOld(inst, instL = None):
     else:
         return "UNKNOWN"
 
+FORWARD_CHECK = 0x1000
+""" Most cycles `run()` executes between checks for a loop that can be fast-forwarded """
+FORWARD_MIN = 0x80
+""" Cycles between checks right after a loop was fast-forwarded; doubled after every check that finds nothing """
+MAX_LOOP = 0x40
+""" Longest loop, in cycles, that is fast-forwarded """
+MAX_FUSE = 3
+""" Most instructions in a fused idiom """
+NEVER = 1 << 62
+_MEMORY_WEIGHTS = [random.Random(adr).getrandbits(128) for adr in range(0x100)]
+""" Random weight of each memory address for the memory key of `_runDetect()`; two memories collide with negligible chance """
+CHECKPOINT_MAGIC = b'SMCK'
+CHECKPOINT_VERSION = 1
+CHECKPOINT_HEADER = struct.Struct('<4sHhHIQQH')
+""" Checkpoint file header: magic, version, exitCode, pgmi, stack length, en, mxEn and peripheral count. It is followed by
+the registers, memory and peripheral memory, the stack as bytes, then each peripheral's address, state length and state """
+CHECKPOINT_PERIPHERAL = struct.Struct('<HI')
+
+def _branchTaken(op: int, r0: tuple[int, int], r: tuple[int, int], k: int):
+    """ Whether a JUMP or JUMP_L comparing r0 with r, as (base, step) values, is taken in iteration k """
+    a = (r0[0] + k*r0[1]) & 0xff
+    b = (r[0] + k*r[1]) & 0xff
+    return a == b if op == asm.JUMP else b < a
+
+class RunResult:
+    """ Outcome of a `CPU.run()` call """
+    HALT = 'halt'
+    """ HALT instruction was executed """
+    STACK_OVERFLOW = 'stackOverflow'
+    """ Stack grew past 0x100 entries """
+    MAX_EXECUTE = 'maxExecute'
+    """ CPU reached `mxEn` cycles """
+    END_OF_MEMORY = 'endOfMemory'
+    """ Program index ran off the end of memory """
+    BUDGET = 'budget'
+    """ `maxCycles` for this run were used up. The CPU can be resumed """
+    BREAK = 'break'
+    """ A breakpoint, watchpoint or register condition of `CPU.debugger` was hit. See `Debugger.lastStop` """
+    LOOP = 'loop'
+    """ Machine state repeated, so the program can never halt. See `loopEntry` and `loopPeriod` """
+    WAIT = 'wait'
+    """ A `LOAD_P` is parked until its peripheral has input. See `CPU.waiting`; the load is retried on the next run.
+    The parked attempt takes no cycle, so `en` does not depend on when input arrives """
+    
+    def __init__(self, reason: str, exitCode: int, cycles: int, elapsed: float):
+        self.reason = reason
+        self.exitCode = exitCode
+        self.cycles = cycles
+        """ Cycles used by this run """
+        self.elapsed = elapsed
+        """ Wall time of this run in seconds """
+        self.loopEntry: int|None = None
+        """ Address the repeated state was seen at, for `LOOP` """
+        self.loopPeriod: int|None = None
+        """ Cycles between the repeated states, for `LOOP` """
+    
+    def __str__(self):
+        loop = f', loopEntry={self.loopEntry}, loopPeriod={self.loopPeriod}' if self.reason == RunResult.LOOP else ''
+        return 'RunResult {' + f'reason={self.reason}, exitCode={self.exitCode}, cycles={self.cycles}{loop}, elapsed={self.elapsed*1000:.3f}ms' + '}'
+
+class CPUState:
+    """ Copy of the machine state made by `CPU.snapshot()` """
+    def __init__(self, cpu: 'CPU'):
+        self.register = bytes(cpu.register)
+        self.memory = bytes(cpu.memory)
+        self.peripheral = bytes(cpu.peripheral)
+        self.pgmi = cpu.pgmi
+        self.en = cpu.en
+        self.mxEn = cpu.mxEn
+        self.stack = tuple(cpu.stack)
+        self.exitCode = cpu.exitCode
+        self.peripherals = [per.snapshot() for per in cpu.peripherals]
+        """ State of each attached peripheral, in attach order """
+
 class CPU:
     
     def __init__(self, pr=False):
         self.pr = pr
+        self.tracer: TraceRecorder|None = None
+        """ Records every executed instruction when set. Much cheaper than `pr` """
+        self.profiler: Profiler|None = None
+        """ Counts cycles per op code and address when set """
+        self.fastForward = True
+        """ Let `run()` skip iterations of loops that leave the machine state unchanged or step registers by constants """
+        self.journal: Journal|None = None
+        """ Records what each step overwrites so it can be undone with `stepBack()` """
+        self.debugger: Debugger|None = None
+        """ Stops `run()` at breakpoints and watchpoints when set """
+        self.fuse = True
+        """ Let `run()` execute common compiler idioms, e.g. `LOAD` + `STORE_P`, as one operation """
+        self.detectLoops = False
+        """ Let `run()` stop with `RunResult.LOOP` when the machine state at a backward jump target repeats.
+        Only checked when every peripheral is quiet (`quietUntil()` is None) and no debugger, tracer, journal,
+        profiler or `pr` is set, and then `jit` and `fastForward` are not used. Otherwise `run()` runs as if it were off """
+        self._loop: tuple[int, int]|None = None
+        self.waiting: Peripheral|None = None
+        """ Peripheral the last run stopped waiting on with `RunResult.WAIT` """
+        self._parkedTick: int|None = None
+        """ Cycle whose clocked peripherals already ticked before a load parked on it and gave the cycle back """
         self.mxEn = 0x10000
         self.peripherals: list[Peripheral] = []
+        self._bus: list[Peripheral|None] = [None] * 0x100
+        """ Bus peripheral owning each peripheral address """
+        self._legacy: list[Peripheral] = []
+        """ Peripherals updated every cycle """
+        self._clocked: list[Peripheral] = []
+        """ Peripherals with a clock divider """
+        self.register = bytearray(0x10)
+        self.memory = bytearray(0x100)
+        self.peripheral = bytearray(0x100)
+        self.registerView = memoryview(self.register).toreadonly()
+        """ Read-only view of the registers """
+        self.memoryView = memoryview(self.memory).toreadonly()
+        """ Read-only view of the memory """
+        self.peripheralView = memoryview(self.peripheral).toreadonly()
+        """ Read-only view of the peripheral memory """
+        self._decoded: list[tuple|None] = [None] * 0x100
+        """ Pre-decoded instruction at each address; `None` if not decoded yet """
+        self._fused: list[tuple|bool|None] = [None] * 0x100 + [False]
+        """ Fused idiom starting at each address as (count, handler, next pgmi, *decoded); `None` if not checked yet, `False` if none """
+        self._fuseCover = bytearray(0x100)
+        """ Non-zero at memory read by a fused idiom """
+        self._handlers = [
+            self._opNoOp, self._opLoadMem, self._opLoad, self._opStore,
+            self._opMove, self._opAddS, self._opAddF, self._opOr,
+            self._opAnd, self._opXor, self._opRotate, self._opJump,
+            self._opHalt, self._opStoreP, self._opLoadP, self._opJumpL,
+        ]
+        self._moveHandlers = [self._opMove, self._opMoveFromSpec, self._opMoveToSpec, self._opMoveSpec]
+        self._jit: BlockJit|None = None
         self.reset()
     
     def reset(self):
-        self.register = [bytes(1)] * 0x10
-        self.memory = [bytes(1)] * 0x100
-        self.peripheral = [bytes(1)] * 0x100
+        # Zero in place so the views stay valid across resets
+        self.register[:] = bytes(0x10)
+        self.memory[:] = bytes(0x100)
+        self.peripheral[:] = bytes(0x100)
+        self.invalidate()
         
         self.pgmi = 0x00
         self.en = 0
+        self._parkedTick = None
 
-        self.stack = []
+        self.stack: list[int] = []
         self.exitCode = -1
         for per in self.peripherals:
             per.clear()
+        if self.journal: self.journal.clear()
     
     def clear(self):
         self.pgmi = 0x00
         self.en = 0
+        self._parkedTick = None
         self.stack = []
         self.exitCode = -1
         for per in self.peripherals:
             per.clear()
+        if self.journal: self.journal.clear()
     
     def step(self):
-        for per in self.peripherals:
+        self.waiting = None
+        journal = self.journal
+        if journal: journal.recordPeripherals(self)
+        for per in self._legacy:
             per.preUpdate()
             
         self.en += 1
+        if self._clocked: self._tick()
         rt = False
         if self.pgmi < 0xff and self.en < self.mxEn:
-            cInst = int.from_bytes(b''.join([self.memory[self.pgmi],self.memory[self.pgmi+1]]), byteorder="big")
+            adr = self.pgmi
+            handler, reg, opr, opr1, opr2, cInst = self._decoded[adr] or self._decode(adr)
+            if journal: journal.record(self, cInst)
             self.pgmi += 2
             if self.pr: print("{0}| 0x{1} {2}".format(convert.toHex(self.pgmi,2),convert.toHex(cInst,4),asm.strInstr(cInst)))
-            rt = self._processInst(cInst)
-        elif self.en >= self.mxEn:
-            if self.pr: print("Max execute reached, terminating")
+            rt = handler(reg, opr, opr1, opr2)
+            if self.waiting:
+                self.en -= 1
+                self._parkedTick = self.en + 1
+            if self.tracer: self.tracer.record(self, adr, cInst)
+            if self.profiler: self.profiler.record(adr, cInst)
         else:
-            if self.pr: print("End of memory reached without HALT")
+            if journal: journal.record(self, None)
+            if self.en >= self.mxEn:
+                if self.pr: print("Max execute reached, terminating")
+            else:
+                if self.pr: print("End of memory reached without HALT")
         
-        for per in self.peripherals:
+        for per in self._legacy:
             per.update()
         
         return rt
     
-    def _processInst(self, inst: int):
+    def stepBack(self):
+        """ Undo the last step recorded by `journal`. Returns False if there is nothing to undo """
+        if not self.journal: raise Exception('Must set a journal before stepping back')
+        return self.journal.undo(self)
+    
+    def runBack(self, n: int):
+        """ Undo up to `n` steps. Returns the number of steps undone """
+        for i in range(n):
+            if not self.stepBack():
+                return i
+        return n
+    
+    def run(self, maxCycles: int|None = None, jit=False):
+        """ Run until HALT, `mxEn` cycles, the end of memory or `maxCycles` cycles, whichever is first.
+        Ends in the same state as calling `step()` until it returns False.
+        With `jit` set, code is compiled to Python functions a basic block at a time unless per-cycle or clocked peripherals are attached """
+        start = time.perf_counter()
+        startEn = self.en
+        self.waiting = None
+        if self.debugger and self.debugger.active():
+            reason = self._runDebug(maxCycles)
+        elif self.pr or self.tracer or self.journal or (self.profiler and self.profiler.every == 1):
+            reason = self._runSteps(maxCycles)
+        elif self.profiler:
+            reason = self._runSampled(maxCycles)
+        elif self.detectLoops and all(per.quietUntil() is None for per in self.peripherals):
+            reason = self._runDetect(maxCycles)
+        elif jit and not self._legacy and not self._clocked:
+            if not self._jit:
+                self._jit = BlockJit(self)
+            reason = self._jit.run(maxCycles)
+        elif self.fastForward:
+            reason = self._runForward(maxCycles)
+        else:
+            reason = self._runFast(maxCycles)
+        result = RunResult(reason, self.exitCode, self.en - startEn, time.perf_counter() - start)
+        if reason == RunResult.LOOP:
+            result.loopEntry, result.loopPeriod = self._loop
+        return result
+    
+    async def runAsync(self, maxCycles: int|None = None, sliceCycles: int = 0x1000, jit=False):
+        """ `run()` as a coroutine: runs `sliceCycles` cycles at a time, yielding to the event loop in between.
+        A `LOAD_P` parked by its peripheral awaits the peripheral's `ready()` instead of spinning """
+        start = time.perf_counter()
+        startEn = self.en
+        budgetEn = None if maxCycles is None else self.en + maxCycles
+        while True:
+            n = sliceCycles if budgetEn is None else min(sliceCycles, budgetEn - self.en)
+            result = self.run(n, jit)
+            if result.reason == RunResult.WAIT:
+                await self.waiting.ready()
+            elif result.reason == RunResult.BUDGET and self.en != budgetEn:
+                await asyncio.sleep(0)
+            else:
+                break
+        result.cycles = self.en - startEn
+        result.elapsed = time.perf_counter() - start
+        return result
+    
+    def _stopReason(self, handler):
+        """ Reason for an instruction handler returning False """
+        if self.waiting:
+            return RunResult.WAIT
+        return RunResult.HALT if handler == self._opHalt else RunResult.STACK_OVERFLOW
+    
+    def _runSteps(self, maxCycles: int|None):
+        budgetEn = None if maxCycles is None else self.en + maxCycles
+        while self.en != budgetEn:
+            adr = self.pgmi
+            if adr >= 0xff or self.en + 1 >= self.mxEn:
+                self.step()
+                return RunResult.MAX_EXECUTE if self.en >= self.mxEn else RunResult.END_OF_MEMORY
+            handler = (self._decoded[adr] or self._decode(adr))[0]
+            if not self.step():
+                return self._stopReason(handler)
+        return RunResult.BUDGET
+    
+    def _runDebug(self, maxCycles: int|None):
+        """ `_runSteps()` that stops at breakpoints before an instruction and at watchpoints after it.
+        The breakpoint the last run stopped at is passed over so a stopped run can be continued """
+        debugger = self.debugger
+        breakpoints = debugger.breakpoints
+        budgetEn = None if maxCycles is None else self.en + maxCycles
+        last = debugger.lastStop
+        resumeEn = last.en if last and last.kind == B_BREAK and last.adr == self.pgmi else None
+        while self.en != budgetEn:
+            adr = self.pgmi
+            if adr >= 0xff or self.en + 1 >= self.mxEn:
+                self.step()
+                return RunResult.MAX_EXECUTE if self.en >= self.mxEn else RunResult.END_OF_MEMORY
+            handler, _, _, _, _, inst = self._decoded[adr] or self._decode(adr)
+            if breakpoints[adr] and self.en != resumeEn:
+                debugger.lastStop = DebugStop(B_BREAK, adr, self.en)
+                return RunResult.BREAK
+            rt = self.step()
+            if self.waiting:
+                return RunResult.WAIT
+            if debugger.hits(inst):
+                stop = debugger.check(self, adr, inst)
+                if stop:
+                    debugger.lastStop = stop
+                    return RunResult.BREAK
+            if not rt:
+                return self._stopReason(handler)
+        return RunResult.BUDGET
+    
+    def _runSampled(self, maxCycles: int|None):
+        budgetEn = None if maxCycles is None else self.en + maxCycles
+        profiler = self.profiler
+        while True:
+            period = profiler.interval()
+            n = period if budgetEn is None else min(period, budgetEn - self.en)
+            if n == 0:
+                return RunResult.BUDGET
+            reason = self._runFast(n)
+            if reason != RunResult.BUDGET:
+                return reason
+            profiler.sample(self, n)
+    
+    def _runForward(self, maxCycles: int|None):
+        budgetEn = None if maxCycles is None else self.en + maxCycles
+        check = FORWARD_MIN
+        while True:
+            n = check if budgetEn is None else min(check, budgetEn - self.en)
+            if n == 0:
+                return RunResult.BUDGET
+            reason = self._runFast(n)
+            if reason != RunResult.BUDGET:
+                return reason
+            en = self.en
+            reason = self._skipLoop(budgetEn)
+            if reason:
+                return reason
+            check = FORWARD_MIN if self.en - en > MAX_LOOP else min(check * 2, FORWARD_CHECK)
+    
+    def _loopState(self):
+        return (self.pgmi, bytes(self.register), bytes(self.memory), bytes(self.peripheral), tuple(self.stack), self.exitCode)
+    
+    def _skipLoop(self, budgetEn: int|None):
+        """ Step up to `MAX_LOOP` cycles looking for a return to the current state. If found, every further
+        iteration is identical, so whole iterations are added to `en` up to the last cycle before `mxEn`,
+        the budget or a peripheral becoming able to change its input. A loop that returns to the current
+        program index in a different state is handed to `_summarize()`. Returns a reason if the CPU stopped """
+        limitEn = self.mxEn - 1 if budgetEn is None else min(budgetEn, self.mxEn - 1)
+        for per in self.peripherals:
+            quiet = per.quietUntil()
+            if quiet is not None:
+                limitEn = min(limitEn, quiet - 1)
+        if limitEn - self.en < 2 * MAX_LOOP:
+            return None
+        head = self._loopState()
+        startEn = self.en
+        path: list[int] = []
+        writes = False
+        """ Peripherals may act on every write, even of an unchanged value, so such loops are only summarized """
+        for _ in range(MAX_LOOP):
+            adr = self.pgmi
+            if adr < 0xff and (self._decoded[adr] or self._decode(adr))[0] == self._opStoreP:
+                writes = True
+            path.append(adr)
+            reason = self._runFast(1)
+            if reason != RunResult.BUDGET:
+                return reason
+            if self.pgmi == head[0]:
+                if not writes and self._loopState() == head:
+                    period = self.en - startEn
+                    skip = (limitEn - self.en) // period - 1
+                    if skip > 0:
+                        self.en += skip * period
+                    return None
+                if self._summarize(path, head[1], head[2], limitEn):
+                    return None
+                if writes:
+                    return None
+        return None
+    
+    def _summarize(self, path: list[int], registers: bytes, memory: bytes, limitEn: int):
+        """ Apply further iterations of the loop just run along `path` from `registers` and `memory` in one go,
+        for as long as every iteration takes the same path. Each register and each memory cell the body stores
+        to must change by the same step every iteration; the body may only load, store, move and add, do bitwise
+        ops on values that do not change, jump and write to peripherals that only act on writes. Iterations
+        stop before `limitEn`. Returns True if any were applied """
+        reg = self.register
+        mem = self.memory
+        code = {adr + i for adr in path for i in (0, 1)}
+        stored = set()
+        for adr in path:
+            inst = (self._decoded[adr] or self._decode(adr))[5]
+            if inst >> 12 == asm.STORE:
+                stored.add(inst & 0xff)
+        if stored & code:
+            return False
+        # Values are (base, step): the value in iteration k is base + k*step, mod 0x100
+        sym = [(reg[i], (reg[i] - registers[i]) & 0xff) for i in range(0x10)]
+        symMem = {a: (mem[a], (mem[a] - memory[a]) & 0xff) for a in stored}
+        start = (list(sym), dict(symMem))
+        writes: list[tuple[int, Peripheral|None, tuple[int, int]]] = []
+        branches: list[tuple[int, tuple[int, int], tuple[int, int]]] = []
+        for i, adr in enumerate(path):
+            nxt = path[i+1] if i + 1 < len(path) else path[0]
+            _, r, opr, opr1, opr2, inst = self._decoded[adr] or self._decode(adr)
+            op = inst >> 12
+            if op == asm.NO_OP:
+                pass
+            elif op == asm.LOAD:
+                sym[r] = (opr, 0)
+            elif op == asm.LOAD_MEM:
+                sym[r] = symMem.get(opr, (mem[opr], 0))
+            elif op == asm.STORE:
+                symMem[opr] = sym[r]
+            elif op == asm.MOVE and r == 0x0:
+                sym[opr2] = sym[opr1]
+            elif op == asm.ADD_S:
+                a, b = sym[opr1], sym[opr2]
+                sym[r] = ((a[0] + b[0]) & 0xff, (a[1] + b[1]) & 0xff)
+            elif op in (asm.ADD_F, asm.OR, asm.AND, asm.XOR) and sym[opr1][1] == 0 and sym[opr2][1] == 0:
+                a, b = sym[opr1][0], sym[opr2][0]
+                if op == asm.ADD_F:
+                    v = addTable()[(a << 8) | b]
+                else:
+                    v = a | b if op == asm.OR else a & b if op == asm.AND else a ^ b
+                sym[r] = (v, 0)
+            elif op == asm.ROTATE and sym[r][1] == 0:
+                n = opr2 & 0x7
+                sym[r] = (((sym[r][0] >> n) | (sym[r][0] << (8 - n))) & 0xff, 0)
+            elif op == asm.STORE_P:
+                owner = self._bus[opr]
+                if owner and owner.quietUntil() is not None:
+                    return False
+                writes.append((opr, owner, sym[r]))
+            elif op == asm.JUMP or op == asm.JUMP_L:
+                if opr == adr + 2:
+                    continue
+                if (nxt == opr) != _branchTaken(op, sym[0], sym[r], 0):
+                    return False
+                if sym[0][1] or sym[r][1]:
+                    branches.append((op, sym[0], sym[r]))
+            else:
+                return False
+        # Iteration k must end in the state iteration k+1 starts from
+        for (b, d), (b2, d2) in zip(start[0], sym):
+            if d2 != d or b2 != (b + d) & 0xff:
+                return False
+        for a, (b, d) in start[1].items():
+            if symMem[a] != ((b + d) & 0xff, d):
+                return False
+        # Values repeat every 0x100 iterations, so a branch that keeps its direction that long keeps it forever
+        n = (limitEn - self.en) // len(path)
+        for op, a, b in branches:
+            taken = _branchTaken(op, a, b, 0)
+            for k in range(1, min(n, 0x100)):
+                if _branchTaken(op, a, b, k) != taken:
+                    n = k
+                    break
+        if n <= 0:
+            return False
+        per = self.peripheral
+        for k in range(n):
+            for adr, owner, (b, d) in writes:
+                v = (b + k*d) & 0xff
+                per[adr] = v
+                if owner: owner.onStore(adr, v)
+        for i, (b, d) in enumerate(start[0]):
+            reg[i] = (b + n*d) & 0xff
+        for a, (b, d) in start[1].items():
+            if d:
+                self._restoreMemory(a, (b + n*d) & 0xff)
+        self.en += n * len(path)
+        return True
+    
+    def _runFast(self, maxCycles: int|None):
+        decoded = self._decoded
+        decode = self._decode
+        peripherals = self._legacy
+        # Idioms are only fused when no peripheral has to see each cycle
+        fused = self._fused if self.fuse and not peripherals else None
+        mxEn = self.mxEn
+        en = self.en
+        nextTick = self._nextTick(en)
+        budgetEn = None if maxCycles is None else en + maxCycles
+        fuseLimit = min(mxEn - 1, nextTick - 1, NEVER if budgetEn is None else budgetEn)
+        """ Last cycle a fused idiom may end on """
+        reason = RunResult.BUDGET
+        try:
+            while en != budgetEn:
+                if fused:
+                    f = fused[self.pgmi]
+                    if f is None:
+                        f = self._fuse(self.pgmi)
+                    if f and en + f[0] <= fuseLimit:
+                        en += f[0]
+                        self.pgmi = f[1](f[2], f[3], f[4], f[5])
+                        continue
+                if peripherals:
+                    for per in peripherals:
+                        per.preUpdate()
+                en += 1
+                if en >= nextTick:
+                    self.en = en
+                    self._tick()
+                    nextTick = self._nextTick(en)
+                    fuseLimit = min(mxEn - 1, nextTick - 1, NEVER if budgetEn is None else budgetEn)
+                adr = self.pgmi
+                if adr >= 0xff or en >= mxEn:
+                    reason = RunResult.MAX_EXECUTE if en >= mxEn else RunResult.END_OF_MEMORY
+                    break
+                handler, reg, opr, opr1, opr2, _ = decoded[adr] or decode(adr)
+                self.pgmi = adr + 2
+                if not handler(reg, opr, opr1, opr2):
+                    reason = self._stopReason(handler)
+                    if self.waiting:
+                        en -= 1
+                        self._parkedTick = en + 1
+                    break
+                if peripherals:
+                    for per in peripherals:
+                        per.update()
+        finally:
+            self.en = en
+        if peripherals and reason != RunResult.BUDGET:
+            for per in peripherals:
+                per.update()
+        return reason
+    
+    def _runDetect(self, maxCycles: int|None):
+        """ `_runFast()` that also looks up the machine state at the target of every backward jump, which every
+        repeating path passes. Peripherals must all be quiet, so a repeated state means the program will repeat forever.
+        Memory is keyed by a weighted sum kept up to date on each `STORE`; registers, stack and, when written since
+        the last lookup, peripheral memory are copied into the key """
+        decoded = self._decoded
+        decode = self._decode
+        peripherals = self._legacy
+        opStore = self._opStore
+        opStoreP = self._opStoreP
+        opLoadP = self._opLoadP
+        register = self.register
+        memory = self.memory
+        weights = _MEMORY_WEIGHTS
+        memKey = sum(v * w for v, w in zip(memory, weights))
+        """ Sum of each memory cell times the weight of its address """
+        perKey = bytes(self.peripheral)
+        perDirty = False
+        mxEn = self.mxEn
+        en = self.en
+        nextTick = self._nextTick(en)
+        budgetEn = None if maxCycles is None else en + maxCycles
+        reason = RunResult.BUDGET
+        seen: dict[tuple, int] = {}
+        """ State at a backward jump target to the cycle it was seen at """
+        try:
+            while en != budgetEn:
+                if peripherals:
+                    for per in peripherals:
+                        per.preUpdate()
+                en += 1
+                if en >= nextTick:
+                    self.en = en
+                    self._tick()
+                    nextTick = self._nextTick(en)
+                adr = self.pgmi
+                if adr >= 0xff or en >= mxEn:
+                    reason = RunResult.MAX_EXECUTE if en >= mxEn else RunResult.END_OF_MEMORY
+                    break
+                handler, reg, opr, opr1, opr2, _ = decoded[adr] or decode(adr)
+                self.pgmi = adr + 2
+                if handler == opStore:
+                    memKey += (register[reg] - memory[opr]) * weights[opr]
+                elif handler == opStoreP or handler == opLoadP:
+                    perDirty = True
+                if not handler(reg, opr, opr1, opr2):
+                    reason = self._stopReason(handler)
+                    if self.waiting:
+                        en -= 1
+                        self._parkedTick = en + 1
+                    break
+                if peripherals:
+                    perDirty = True
+                    for per in peripherals:
+                        per.update()
+                if self.pgmi <= adr:
+                    if perDirty:
+                        perKey = bytes(self.peripheral)
+                        perDirty = False
+                    key = (self.pgmi, memKey, bytes(register), perKey, self.exitCode, tuple(self.stack))
+                    if key in seen:
+                        self._loop = (self.pgmi, en - seen[key])
+                        return RunResult.LOOP
+                    seen[key] = en
+        finally:
+            self.en = en
+        if peripherals and reason != RunResult.BUDGET:
+            for per in peripherals:
+                per.update()
+        return reason
+    
+    def _decodeInst(self, inst: int):
+        """ Split an instruction into its handler and operands """
         op = (inst&0xf000) >> 12
         reg = (inst&0x0f00) >> 8
         opr = (inst&0x00ff)
         opr1 = (inst&0x00f0) >> 4
         opr2 = (inst&0x000f)
-        # print("{0}: {1},{2},{3}".format(op,reg,opr1,opr2))
-
-        if(op == asm.LOAD_MEM): # LOAD_MEM
-            self.register[reg] = self.memory[opr]
-        elif(op == asm.LOAD): # LOAD
-            self.register[reg] = bytes([opr])
-        elif(op == asm.STORE): # STORE
-            self.memory[opr] = self.register[reg]
-        elif(op == asm.MOVE): # MOVE
-            if reg == 0x0: # Standard registers
-                self.register[opr2] = self.register[opr1]
-            elif reg == 0x1: # From spec to normal
-                if opr1 == asm.R_PGMI:
-                    self.register[opr2] = bytes([self.pgmi])
-                elif opr1 == asm.R_STACK:
-                    if len(self.stack) > 0:
-                        self.register[opr2] = self.stack.pop()
-                    else:
-                        self.register[opr2] = bytes([0x00])
-                elif opr1 == asm.R_EXIT:
-                    self.register[opr2] = bytes([self.exitCode])
-            elif reg == 0x2: # From normal to spec
-                val = int.from_bytes(self.register[opr1], "big")
-                if opr2 == asm.R_PGMI:
-                    self.pgmi = val
-                elif opr2 == asm.R_STACK:
-                    self.stack.append(self.register[opr1])
-                elif opr2 == asm.R_EXIT:
-                    self.exitCode = val
-            elif reg == 0x3: # From spec to spec
-                val = bytes([0x00])
-                if opr1 == asm.R_PGMI:
-                    val = bytes([self.pgmi])
-                elif opr1 == asm.R_STACK:
-                    if len(self.stack) > 0:
-                        val = self.stack.pop()
-                elif opr1 == asm.R_EXIT:
-                    val = bytes([self.exitCode])
-                if opr2 == asm.R_PGMI:
-                    self.pgmi = int.from_bytes(val, "big")
-                elif opr2 == asm.R_STACK:
-                    if len(self.stack) <= 0xff:
-                        self.stack.append(val)
-                    else:
-                        self.exitCode = 1
-                        return False
-                elif opr2 == asm.R_EXIT:
-                    self.exitCode = int.from_bytes(val, "big")
-        elif(op == asm.ADD_S): # ADD_S 2cp add
-            b0 = self.register[opr1]
-            b1 = self.register[opr2]
-            ot = b0[0] + b1[0]
-            self.register[reg] = bytes([ot&0xff])
-        elif(op == asm.ADD_F): # ADD_F 8b float add
-            # registers
-            pass
-        elif(op == asm.OR): # OR
-            self.register[reg] = bytes([self.register[opr1][0] | self.register[opr2][0]])
-        elif(op == asm.AND): # AND
-            self.register[reg] = bytes([self.register[opr1][0] & self.register[opr2][0]])
-        elif(op == asm.XOR): # XOR
-            self.register[reg] = bytes([self.register[opr1][0] ^ self.register[opr2][0]])
-        elif(op == asm.ROTATE): # ROTATE
-            tmp = (int.from_bytes(self.register[reg], "big")&0x1) << 7
-            out = (int.from_bytes(self.register[reg], "big") >> 0x1) + tmp
-            self.register[reg] = bytes([out])
-        elif(op == asm.JUMP): # JUMP
-            if(self.register[0] == self.register[reg]):
-                self.pgmi = opr
-        elif(op == asm.HALT): # HALT
+        if op == asm.MOVE:
+            handler = self._moveHandlers[reg] if reg < len(self._moveHandlers) else self._opNoOp
+        else:
+            handler = self._handlers[op]
+        return (handler, reg, opr, opr1, opr2, inst)
+    
+    def _decode(self, adr: int):
+        """ Decode the instruction at `adr` and cache it """
+        decoded = self._decodeInst((self.memory[adr] << 8) | self.memory[adr+1])
+        self._decoded[adr] = decoded
+        return decoded
+    
+    def _fuse(self, adr: int):
+        """ Find and cache the fused idiom starting at `adr` """
+        fused = False
+        if adr + 3 < 0xff:
+            first = self._decoded[adr] or self._decode(adr)
+            second = self._decoded[adr+2] or self._decode(adr+2)
+            op1 = first[5] >> 12
+            op2 = second[5] >> 12
+            nxt = adr + 4
+            if op1 == asm.LOAD and op2 == asm.STORE_P: # basicFunctions.write
+                fused = (2, self._fuseWrite, nxt, first, second, None)
+            elif op1 == asm.LOAD and op2 == asm.MOVE and second[1] == 0x2 and second[4] == asm.R_STACK and adr + 5 < 0xff:
+                third = self._decoded[adr+4] or self._decode(adr+4)
+                if third[5] >> 12 == asm.JUMP: # GotoFuncChunk
+                    fused = (3, self._fuseCall, adr + 6, first, second, third)
+            elif op1 == asm.LOAD and op2 == asm.ADD_S:
+                fused = (2, self._fuseLoadAdd, nxt, first, second, None)
+            elif op1 == asm.LOAD_MEM and op2 == asm.STORE:
+                fused = (2, self._fuseCopy, nxt, first, second, None)
+            elif op1 == asm.STORE and op2 == asm.LOAD_MEM and first[2] not in (adr+2, adr+3):
+                fused = (2, self._fuseSpill, nxt, first, second, None)
+            elif op1 == asm.ADD_S and op2 == asm.JUMP:
+                fused = (2, self._fuseAddJump, nxt, first, second, None)
+            elif op1 == asm.ADD_S and op2 == asm.JUMP_L:
+                fused = (2, self._fuseAddJumpL, nxt, first, second, None)
+        if fused:
+            self._fuseCover[adr:adr + 2*fused[0]] = b'\x01' * (2*fused[0])
+        self._fused[adr] = fused
+        return fused
+    
+    def _unfuse(self, adr: int):
+        """ Drop fused idioms that read memory `adr` """
+        start = max(adr - 2*MAX_FUSE + 1, 0)
+        self._fused[start:adr+1] = [None] * (adr + 1 - start)
+    
+    # Fused idioms. Each takes the pgmi after the idiom and the decoded instructions, and returns the new pgmi
+    def _fuseWrite(self, nxt: int, a: tuple, b: tuple, c: None): # LOAD rX c, STORE_P rY p
+        self.register[a[1]] = a[2]
+        self._opStoreP(b[1], b[2], 0, 0)
+        return nxt
+    
+    def _fuseCall(self, nxt: int, a: tuple, b: tuple, c: tuple): # LOAD rX ret, MOVE rY -> R_STACK, JUMP
+        r = self.register
+        r[a[1]] = a[2]
+        self.stack.append(r[b[3]])
+        return c[2] if r[0] == r[c[1]] else nxt
+    
+    def _fuseLoadAdd(self, nxt: int, a: tuple, b: tuple, c: None): # LOAD rX c, ADD_S
+        r = self.register
+        r[a[1]] = a[2]
+        r[b[1]] = (r[b[3]] + r[b[4]]) & 0xff
+        return nxt
+    
+    def _fuseCopy(self, nxt: int, a: tuple, b: tuple, c: None): # LOAD_MEM, STORE
+        self.register[a[1]] = self.memory[a[2]]
+        self._opStore(b[1], b[2], 0, 0)
+        return nxt
+    
+    def _fuseSpill(self, nxt: int, a: tuple, b: tuple, c: None): # STORE, LOAD_MEM
+        self._opStore(a[1], a[2], 0, 0)
+        self.register[b[1]] = self.memory[b[2]]
+        return nxt
+    
+    def _fuseAddJump(self, nxt: int, a: tuple, b: tuple, c: None): # ADD_S, JUMP
+        r = self.register
+        r[a[1]] = (r[a[3]] + r[a[4]]) & 0xff
+        return b[2] if r[0] == r[b[1]] else nxt
+    
+    def _fuseAddJumpL(self, nxt: int, a: tuple, b: tuple, c: None): # ADD_S, JUMP_L
+        r = self.register
+        r[a[1]] = (r[a[3]] + r[a[4]]) & 0xff
+        return b[2] if r[b[1]] < r[0] else nxt
+    
+    def _restoreMemory(self, adr: int, v: int):
+        """ Write a memory cell outside of an instruction, dropping decodes that read it """
+        self.memory[adr] = v
+        self._decoded[adr] = None
+        if adr > 0x00:
+            self._decoded[adr-1] = None
+        if self._fuseCover[adr]: self._unfuse(adr)
+        if self._jit:
+            self._jit.invalidate(adr, adr+1)
+    
+    def invalidate(self, start: int = 0x00, end: int = 0x100):
+        """ Drop cached decodes for instructions overlapping memory `start` to `end` (exclusive).
+        Must be called after writing to `memory` directly """
+        self._decoded[max(start-1, 0):end] = [None] * (end - max(start-1, 0))
+        fuseStart = max(start - 2*MAX_FUSE + 1, 0)
+        self._fused[fuseStart:end] = [None] * (end - fuseStart)
+        if self._jit:
+            # Compiled code is checked against memory before the next run, so reloading the same image keeps it
+            self._jit.stale = True
+    
+    def _processInst(self, inst: int):
+        handler, reg, opr, opr1, opr2, _ = self._decodeInst(inst)
+        return handler(reg, opr, opr1, opr2)
+    
+    def _opNoOp(self, reg: int, opr: int, opr1: int, opr2: int):
+        return True
+    
+    def _opLoadMem(self, reg: int, opr: int, opr1: int, opr2: int):
+        self.register[reg] = self.memory[opr]
+        return True
+    
+    def _opLoad(self, reg: int, opr: int, opr1: int, opr2: int):
+        self.register[reg] = opr
+        return True
+    
+    def _opStore(self, reg: int, opr: int, opr1: int, opr2: int):
+        self.memory[opr] = self.register[reg]
+        # Self-modifying code: drop the decodes that read this byte
+        self._decoded[opr] = None
+        if opr > 0x00:
+            self._decoded[opr-1] = None
+        if self._fuseCover[opr]: self._unfuse(opr)
+        if self._jit and self._jit.coverage[opr]:
+            self._jit.invalidate(opr, opr+1)
+        return True
+    
+    def _opMove(self, reg: int, opr: int, opr1: int, opr2: int): # Standard registers
+        self.register[opr2] = self.register[opr1]
+        return True
+    
+    def _opMoveFromSpec(self, reg: int, opr: int, opr1: int, opr2: int): # From spec to normal
+        if opr1 == asm.R_PGMI:
+            self.register[opr2] = self.pgmi
+        elif opr1 == asm.R_STACK:
+            if len(self.stack) > 0:
+                self.register[opr2] = self.stack.pop()
+            else:
+                self.register[opr2] = 0x00
+        elif opr1 == asm.R_EXIT:
+            self.register[opr2] = self.exitCode
+        return True
+    
+    def _opMoveToSpec(self, reg: int, opr: int, opr1: int, opr2: int): # From normal to spec
+        val = self.register[opr1]
+        if opr2 == asm.R_PGMI:
+            self.pgmi = val
+        elif opr2 == asm.R_STACK:
+            self.stack.append(val)
+        elif opr2 == asm.R_EXIT:
+            self.exitCode = val
+        return True
+    
+    def _opMoveSpec(self, reg: int, opr: int, opr1: int, opr2: int): # From spec to spec
+        val = 0x00
+        if opr1 == asm.R_PGMI:
+            if self.pgmi > 0xff:
+                raise ValueError(f'Program index {self.pgmi} is not a byte value')
+            val = self.pgmi
+        elif opr1 == asm.R_STACK:
+            if len(self.stack) > 0:
+                val = self.stack.pop()
+        elif opr1 == asm.R_EXIT:
+            if not 0x00 <= self.exitCode <= 0xff:
+                raise ValueError(f'Exit code {self.exitCode} is not a byte value')
+            val = self.exitCode
+        if opr2 == asm.R_PGMI:
+            self.pgmi = val
+        elif opr2 == asm.R_STACK:
+            if len(self.stack) <= 0xff:
+                self.stack.append(val)
+            else:
+                self.exitCode = 1
+                return False
+        elif opr2 == asm.R_EXIT:
+            self.exitCode = val
+        return True
+    
+    def _opAddS(self, reg: int, opr: int, opr1: int, opr2: int): # 2cp add
+        self.register[reg] = (self.register[opr1] + self.register[opr2]) & 0xff
+        return True
+    
+    def _opAddF(self, reg: int, opr: int, opr1: int, opr2: int): # 8b float add, see minifloat.py
+        r = self.register
+        r[reg] = addTable()[(r[opr1] << 8) | r[opr2]]
+        return True
+    
+    def _opOr(self, reg: int, opr: int, opr1: int, opr2: int):
+        self.register[reg] = self.register[opr1] | self.register[opr2]
+        return True
+    
+    def _opAnd(self, reg: int, opr: int, opr1: int, opr2: int):
+        self.register[reg] = self.register[opr1] & self.register[opr2]
+        return True
+    
+    def _opXor(self, reg: int, opr: int, opr1: int, opr2: int):
+        self.register[reg] = self.register[opr1] ^ self.register[opr2]
+        return True
+    
+    def _opRotate(self, reg: int, opr: int, opr1: int, opr2: int):
+        n = opr2 & 0x7
+        v = self.register[reg]
+        self.register[reg] = ((v >> n) | (v << (8 - n))) & 0xff
+        return True
+    
+    def _opJump(self, reg: int, opr: int, opr1: int, opr2: int):
+        if self.register[0] == self.register[reg]:
+            self.pgmi = opr
+        return True
+    
+    def _opHalt(self, reg: int, opr: int, opr1: int, opr2: int):
+        return False
+    
+    def _opStoreP(self, reg: int, opr: int, opr1: int, opr2: int):
+        v = self.register[reg]
+        self.peripheral[opr] = v
+        owner = self._bus[opr]
+        if owner: owner.onStore(opr, v)
+        return True
+    
+    def _opLoadP(self, reg: int, opr: int, opr1: int, opr2: int):
+        owner = self._bus[opr]
+        if owner and owner.onLoad(opr) is False:
+            # Parked: the load runs again once the peripheral is ready, and the run loop takes back its cycle
+            self.pgmi -= 2
+            self.waiting = owner
             return False
-        elif(op == asm.STORE_P): # STORE_P
-            self.peripheral[opr] = self.register[reg]
-        elif(op == asm.LOAD_P): # LOAD_P
-            self.register[reg] = self.peripheral[opr]
-        elif(op == asm.JUMP_L): # JUMP_L
-            if(self.register[reg] < self.register[0]):
-                self.pgmi = opr
+        self.register[reg] = self.peripheral[opr]
+        return True
+    
+    def _opJumpL(self, reg: int, opr: int, opr1: int, opr2: int):
+        if self.register[reg] < self.register[0]:
+            self.pgmi = opr
         return True
     
     def loadMemFromInstr(self, instructions: list[int]):
         for i in range(len(instructions)):
             mi = i*2
-            self.memory[mi] = bytes([(instructions[i]&0xff00)>>8])
-            self.memory[mi+1] = bytes([instructions[i]&0xff])
+            self.memory[mi] = (instructions[i]&0xff00)>>8
+            self.memory[mi+1] = instructions[i]&0xff
+        self.invalidate(0x00, len(instructions)*2)
     
-    def loadMemFromBytes(self, arr: list[bytes]):
-        for i in range(len(arr)):
-            self.memory[i] = arr[i]
+    def loadMemFromBytes(self, arr: list[bytes]|bytes|bytearray, adr: int = 0x00):
+        """ Load memory at `adr` from a list of single bytes (as produced by the compilers) or a bytes-like image """
+        if not isinstance(arr, (bytes, bytearray, memoryview)):
+            arr = b''.join(arr)
+        if adr < 0 or adr + len(arr) > len(self.memory):
+            raise ValueError(f'Image of {len(arr)} bytes at {adr} does not fit in {len(self.memory)} bytes of memory')
+        self.memory[adr:adr+len(arr)] = arr
+        self.invalidate(adr, adr+len(arr))
     
-    def loadMemFromBinFile(self, filename: str):
+    def loadMemFromBinFile(self, filename: str, adr: int = 0x00, length: int|None = None):
+        """ Load `length` bytes (default the whole file) of a binary image into memory at `adr`.
+        The file is read straight into memory with a single call. Returns the number of bytes loaded """
         with open(filename, 'rb') as file:
-            i = 0
-            while True:
-                c = file.read(1)
-                if(not c):
-                    break
-                # print(convert.toHex(int.from_bytes(c, "big"),2))
-                self.memory[i] = c
-                i += 1
+            size = os.fstat(file.fileno()).st_size
+            if length is None:
+                length = size
+            elif length > size:
+                raise ValueError(f'{filename} has {size} bytes, fewer than the {length} requested')
+            if adr < 0 or adr + length > len(self.memory):
+                raise ValueError(f'Image of {length} bytes at {adr} does not fit in {len(self.memory)} bytes of memory')
+            n = file.readinto(memoryview(self.memory)[adr:adr+length])
+        self.invalidate(adr, adr+n)
+        return n
+    
+    def snapshot(self):
+        """ Copy the machine state, including the state of attached peripherals """
+        return CPUState(self)
+    
+    def restore(self, state: CPUState):
+        """ Return to a state from `snapshot()`. The same peripherals must be attached as when it was taken """
+        if len(state.peripherals) != len(self.peripherals):
+            raise ValueError(f'Snapshot has {len(state.peripherals)} peripherals, CPU has {len(self.peripherals)}')
+        self.register[:] = state.register
+        if self.memory != state.memory:
+            # Only drop decoded instructions when memory actually changed
+            self.memory[:] = state.memory
+            self.invalidate()
+        self.peripheral[:] = state.peripheral
+        self.pgmi = state.pgmi
+        self.en = state.en
+        self._parkedTick = None
+        self.waiting = None
+        self.mxEn = state.mxEn
+        self.stack = list(state.stack)
+        self.exitCode = state.exitCode
+        if self.journal: self.journal.clear()
+        for per, perState in zip(self.peripherals, state.peripherals):
+            per.restore(perState)
+    
+    def saveCheckpoint(self, path: str):
+        """ Write the machine state, including the state of attached peripherals, to a checkpoint file """
+        header = CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, self.exitCode, self.pgmi, len(self.stack), self.en, self.mxEn, len(self.peripherals))
+        perStates = []
+        for per in self.peripherals:
+            state = per.saveState()
+            perStates += [CHECKPOINT_PERIPHERAL.pack(per.addr, len(state)), state]
+        with open(path, 'wb') as file:
+            file.write(header)
+            file.write(self.register)
+            file.write(self.memory)
+            file.write(self.peripheral)
+            file.write(bytes(self.stack))
+            file.write(b''.join(perStates))
+
+    def loadCheckpoint(self, path: str):
+        """ Return to the state in a file from `saveCheckpoint()`. The same peripherals must be attached as when it was saved """
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size < CHECKPOINT_HEADER.size + 0x210:
+                raise ValueError(f'{path} is too short to be a checkpoint')
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        with data:
+            magic, version, exitCode, pgmi, stackLen, en, mxEn, perCount = CHECKPOINT_HEADER.unpack_from(data)
+            if magic != CHECKPOINT_MAGIC:
+                raise ValueError(f'{path} is not a checkpoint')
+            if version != CHECKPOINT_VERSION:
+                raise ValueError(f'{path} is checkpoint version {version}, expected {CHECKPOINT_VERSION}')
+            if perCount != len(self.peripherals):
+                raise ValueError(f'Checkpoint has {perCount} peripherals, CPU has {len(self.peripherals)}')
+            i = CHECKPOINT_HEADER.size
+            register, memory, peripheral = data[i:i+0x10], data[i+0x10:i+0x110], data[i+0x110:i+0x210]
+            i += 0x210
+            stack = data[i:i+stackLen]
+            i += stackLen
+            perStates = []
+            for per in self.peripherals:
+                if i + CHECKPOINT_PERIPHERAL.size > len(data):
+                    raise ValueError(f'{path} is truncated')
+                addr, n = CHECKPOINT_PERIPHERAL.unpack_from(data, i)
+                if addr != per.addr:
+                    raise ValueError(f'Checkpoint has a peripheral at p{convert.toHex(addr,2)} where the CPU has {type(per).__name__} at p{convert.toHex(per.addr,2)}')
+                i += CHECKPOINT_PERIPHERAL.size
+                perStates.append(data[i:i+n])
+                i += n
+            if len(stack) != stackLen or i > len(data):
+                raise ValueError(f'{path} is truncated')
+        self.register[:] = register
+        if self.memory != memory:
+            self.memory[:] = memory
+            self.invalidate()
+        self.peripheral[:] = peripheral
+        self.pgmi = pgmi
+        self.en = en
+        self.mxEn = mxEn
+        self._parkedTick = None
+        self.waiting = None
+        self.stack = list(stack)
+        self.exitCode = exitCode
+        if self.journal: self.journal.clear()
+        for per, state in zip(self.peripherals, perStates):
+            per.loadState(state)
+
+    def fork(self):
+        """ Independent copy of this CPU with copies of its peripherals attached and the same run options.
+        A journal, debugger, tracer or profiler is not copied """
+        cpu = CPU(self.pr)
+        for per in self.peripherals:
+            cpu.addPeripheral(per.copy())
+        cpu.register[:] = self.register
+        cpu.memory[:] = self.memory
+        cpu.peripheral[:] = self.peripheral
+        cpu.pgmi = self.pgmi
+        cpu.en = self.en
+        cpu.mxEn = self.mxEn
+        cpu.stack = self.stack.copy()
+        cpu.exitCode = self.exitCode
+        cpu.fastForward = self.fastForward
+        cpu.fuse = self.fuse
+        cpu.detectLoops = self.detectLoops
+        if self.waiting:
+            cpu.waiting = cpu.peripherals[self.peripherals.index(self.waiting)]
+        return cpu
     
     def addPeripheral(self, peripheral: Peripheral):
+        if not peripheral.legacy:
+            owned = [adr for start, end in peripheral.ranges() for adr in range(start, end)]
+            for adr in owned:
+                if self._bus[adr]:
+                    raise ValueError(f'Peripheral address p{convert.toHex(adr,2)} is already owned by {type(self._bus[adr]).__name__}')
+            for adr in owned:
+                self._bus[adr] = peripheral
         peripheral.cpu = self
-        self.peripherals.append(peripheral)
\ No newline at end of file
+        self.peripherals.append(peripheral)
+        self._legacy = [per for per in self.peripherals if per.legacy]
+        self._clocked = [per for per in self.peripherals if per.clockDivider]
+    
+    def _tick(self):
+        """ Tick the clocked peripherals due on this cycle """
+        if self.en == self._parkedTick:
+            # Retrying a parked load: this cycle's peripherals were ticked before it parked
+            self._parkedTick = None
+            return
+        for per in self._clocked:
+            if self.en % per.clockDivider == 0:
+                per.tick()
+    
+    def _nextTick(self, en: int):
+        """ First cycle after `en` that ticks a peripheral """
+        if not self._clocked:
+            return NEVER
+        return min((en // per.clockDivider + 1) * per.clockDivider for per in self._clocked)
\ No newline at end of file
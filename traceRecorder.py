@@ -0,0 +1,180 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import struct
+import sys
+
+import asmInstructions as asm
+from convert import toHex
+
+if TYPE_CHECKING:
+    from simpleMachine import CPU
+
+RECORD = struct.Struct('<IHBBBB')
+""" cycle, instruction, pgmi, destination kind, destination address, value """
+MAGIC = b'PBTR\x01'
+""" Header of trace files """
+
+D_NONE = 0
+D_REG = 1
+D_MEM = 2
+D_PER = 3
+D_SPEC = 4
+""" Special register; the destination address is `R_PGMI`, `R_STACK` or `R_EXIT` """
+
+destNames = ['', 'r', 'm', 'p', '']
+
+# Destination kind written by each op code. MOVE depends on its spec field and is handled separately
+_opDest = [
+    D_NONE, D_REG, D_REG, D_MEM,
+    None, D_REG, D_REG, D_REG,
+    D_REG, D_REG, D_REG, D_SPEC,
+    D_NONE, D_PER, D_REG, D_SPEC,
+]
+
+class TraceRecord:
+    """ One executed instruction. Disassembled only when `text()` is called """
+    __slots__ = ('cycle', 'inst', 'pgmi', 'destKind', 'dest', 'value')
+    def __init__(self, cycle: int, inst: int, pgmi: int, destKind: int, dest: int, value: int):
+        self.cycle = cycle
+        self.inst = inst
+        self.pgmi = pgmi
+        """ Address the instruction was fetched from """
+        self.destKind = destKind
+        self.dest = dest
+        self.value = value
+        """ Value of the destination after the instruction """
+
+    def destName(self):
+        if self.destKind == D_NONE:
+            return ''
+        if self.destKind == D_SPEC:
+            return asm.specRegToName(self.dest)
+        return destNames[self.destKind] + toHex(self.dest, 1 if self.destKind == D_REG else 2)
+
+    def text(self):
+        line = f'{self.cycle:>8} {toHex(self.pgmi,2)}| 0x{toHex(self.inst,4)} {asm.strInstr(self.inst)}'
+        if self.destKind != D_NONE:
+            line += f'  ; {self.destName()}=0x{toHex(self.value,2)}'
+        return line
+
+    def __str__(self):
+        return self.text()
+
+class TraceRecorder:
+    """ Records executed instructions as fixed-size binary records, into a ring buffer holding the last
+    `capacity` records or appended to a file. With `every` above 1 only every n-th instruction is recorded.
+    Attach with `cpu.tracer = recorder` """
+    def __init__(self, capacity: int = 0x10000, filename: str|None = None, every: int = 1, flushEvery: int = 0x1000):
+        self.every = every
+        self._skip = 0
+        self.count = 0
+        """ Records written so far, including ones overwritten in the ring buffer """
+        self.filename = filename
+        self._file = None
+        if filename:
+            self._file = open(filename, 'wb')
+            self._file.write(MAGIC)
+            capacity = flushEvery
+        self.capacity = capacity
+        self._buf = bytearray(capacity * RECORD.size)
+        self._i = 0
+        """ Next record slot in the buffer """
+
+    def record(self, cpu: CPU, adr: int, inst: int):
+        """ Record the instruction at `adr` that the CPU just executed """
+        if self.every > 1:
+            self._skip += 1
+            if self._skip < self.every:
+                return
+            self._skip = 0
+        op = inst >> 12
+        kind = _opDest[op]
+        if kind == D_REG:
+            dest = (inst >> 8) & 0xf
+            value = cpu.register[dest]
+        elif kind is None: # MOVE
+            spec = (inst >> 8) & 0xf
+            dest = inst & 0xf
+            if spec < 2:
+                kind = D_REG
+                value = cpu.register[dest]
+            elif spec < 4:
+                kind = D_SPEC
+                value = self._specValue(cpu, dest)
+            else:
+                kind = D_NONE
+                dest = value = 0
+        elif kind == D_MEM:
+            dest = inst & 0xff
+            value = cpu.memory[dest]
+        elif kind == D_PER:
+            dest = inst & 0xff
+            value = cpu.peripheral[dest]
+        elif kind == D_SPEC: # Jumps
+            dest = asm.R_PGMI
+            value = cpu.pgmi & 0xff
+        else:
+            dest = value = 0
+        RECORD.pack_into(self._buf, self._i * RECORD.size, cpu.en & 0xffffffff, inst, adr, kind, dest, value)
+        self.count += 1
+        self._i += 1
+        if self._i == self.capacity:
+            self._i = 0
+            if self._file:
+                self._file.write(self._buf)
+
+    def _specValue(self, cpu: CPU, dest: int):
+        if dest == asm.R_PGMI:
+            return cpu.pgmi & 0xff
+        if dest == asm.R_STACK:
+            return cpu.stack[-1] if cpu.stack else 0
+        if dest == asm.R_EXIT:
+            return cpu.exitCode & 0xff
+        return 0
+
+    def flush(self):
+        """ Write buffered records to the trace file """
+        if self._file:
+            self._file.write(self._buf[:self._i * RECORD.size])
+            self._i = 0
+            self._file.flush()
+
+    def close(self):
+        if self._file:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def clear(self):
+        self._i = 0
+        self._skip = 0
+        self.count = 0
+
+    def records(self):
+        """ Records still in the ring buffer, oldest first """
+        if self._file:
+            raise Exception('Records of a file trace are read with readTrace()')
+        size = RECORD.size
+        if self.count >= self.capacity:
+            data = self._buf[self._i * size:] + self._buf[:self._i * size]
+        else:
+            data = self._buf[:self._i * size]
+        for fields in RECORD.iter_unpack(data):
+            yield TraceRecord(*fields)
+
+def readTrace(filename: str):
+    """ Records of a trace file, in order """
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{filename} is not a trace file')
+        while True:
+            data = f.read(RECORD.size * 0x1000)
+            if not data:
+                break
+            for fields in RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]):
+                yield TraceRecord(*fields)
+
+if __name__ == '__main__':
+    # Disassemble a trace file
+    for rec in readTrace(sys.argv[1]):
+        print(rec.text())
@@ -0,0 +1,264 @@
+from __future__ import annotations
+import numpy as np
+
+from simpleMachine import CPU, RunResult
+import asmInstructions as asm
+from minifloat import addTable
+
+RUNNING = 0
+HALTED = 1
+STACK_OVERFLOW = 2
+MAX_EXECUTE = 3
+END_OF_MEMORY = 4
+ERROR = 5
+""" Lane raised an error in `CPU` (exit code or program index that is not a byte) """
+STACK_CAPACITY = 6
+""" Lane pushed past the stack capacity of the `VectorCPU` """
+OUTPUT_CAPACITY = 7
+""" Lane printed past the output capacity of the `VectorCPU` """
+
+reasonNames = [None, RunResult.HALT, RunResult.STACK_OVERFLOW, RunResult.MAX_EXECUTE, RunResult.END_OF_MEMORY, 'error', 'stackCapacity', 'outputCapacity']
+""" Lane stop code to `RunResult` reason """
+
+class VectorCPU:
+    """ Runs `n` copies of the machine in lockstep, one instruction for every running lane per `step()`.
+    Lanes stop independently and each ends in the same state as running a `CPU` until `step()` returns False.
+    Peripherals are plain memory except an optional console address whose writes are collected per lane """
+    def __init__(self, n: int, consoleAdr: int|None = 0x00, stackSize: int = 0x400, outputSize: int = 0x400):
+        self.n = n
+        self.mxEn = 0x10000
+        self.consoleAdr = consoleAdr
+        self.register = np.zeros((n, 0x10), np.uint8)
+        self.memory = np.zeros((n, 0x100), np.uint8)
+        self.peripheral = np.zeros((n, 0x100), np.uint8)
+        self.pgmi = np.zeros(n, np.int32)
+        self.en = np.zeros(n, np.int64)
+        self.exitCode = np.full(n, -1, np.int32)
+        self.stack = np.zeros((n, stackSize), np.uint8)
+        self.sp = np.zeros(n, np.int32)
+        """ Stack depth of each lane """
+        self.output = np.zeros((n, outputSize), np.uint8)
+        """ Characters written to the console by each lane """
+        self.outLen = np.zeros(n, np.int32)
+        self.stopped = np.zeros(n, np.int8)
+        """ Stop code of each lane, `RUNNING` while it runs """
+
+    def loadMemFromBytes(self, arr: list[bytes]|bytes|bytearray):
+        """ Load the same image into every lane """
+        if not isinstance(arr, (bytes, bytearray, memoryview)):
+            arr = b''.join(arr)
+        if len(arr) > 0x100:
+            raise ValueError(f'Image of {len(arr)} bytes does not fit in {0x100} bytes of memory')
+        self.memory[:, :len(arr)] = np.frombuffer(bytes(arr), np.uint8)
+
+    def active(self):
+        return np.flatnonzero(self.stopped == RUNNING)
+
+    def run(self, maxSteps: int|None = None):
+        """ Step until every lane has stopped or `maxSteps` steps were taken. Returns the number of steps """
+        steps = 0
+        while steps != maxSteps and self.step():
+            steps += 1
+        return steps
+
+    def step(self):
+        """ Run one instruction on every running lane. Returns False once no lane is running """
+        lanes = self.active()
+        if len(lanes) == 0:
+            return False
+        self.en[lanes] += 1
+        pgmi = self.pgmi[lanes]
+
+        over = self.en[lanes] >= self.mxEn
+        end = pgmi >= 0xff
+        self.stopped[lanes[over]] = MAX_EXECUTE
+        self.stopped[lanes[end & ~over]] = END_OF_MEMORY
+        ok = ~(over | end)
+        lanes = lanes[ok]
+        pgmi = pgmi[ok]
+
+        mem = self.memory
+        inst = (mem[lanes, pgmi].astype(np.int32) << 8) | mem[lanes, pgmi+1]
+        self.pgmi[lanes] = pgmi + 2
+        op = inst >> 12
+        for code in np.unique(op):
+            sel = op == code
+            self._ops[code](self, lanes[sel], inst[sel])
+        return True
+
+    def reason(self, lane: int):
+        """ `RunResult` reason a lane stopped for, None while it runs """
+        return reasonNames[self.stopped[lane]]
+
+    def consoleText(self, lane: int):
+        """ Console output of a lane. Lanes stopped with `OUTPUT_CAPACITY` have printed more than this """
+        return bytes(self.output[lane, :self.outLen[lane]]).decode('latin-1')
+
+    def toCPU(self, lane: int):
+        """ Copy the state of a lane into a new `CPU` """
+        cpu = CPU()
+        cpu.register[:] = self.register[lane].tobytes()
+        cpu.memory[:] = self.memory[lane].tobytes()
+        cpu.peripheral[:] = self.peripheral[lane].tobytes()
+        cpu.invalidate()
+        cpu.pgmi = int(self.pgmi[lane])
+        cpu.en = int(self.en[lane])
+        cpu.exitCode = int(self.exitCode[lane])
+        cpu.stack = [int(v) for v in self.stack[lane, :self.sp[lane]]]
+        cpu.mxEn = self.mxEn
+        return cpu
+
+    def _error(self, lanes: np.ndarray):
+        self.stopped[lanes] = ERROR
+
+    def _push(self, lanes: np.ndarray, vals: np.ndarray):
+        full = self.sp[lanes] >= self.stack.shape[1]
+        self.stopped[lanes[full]] = STACK_CAPACITY
+        lanes = lanes[~full]
+        self.stack[lanes, self.sp[lanes]] = vals[~full]
+        self.sp[lanes] += 1
+
+    def _pop(self, lanes: np.ndarray):
+        """ Pop the stack of each lane, 0 for empty stacks """
+        vals = np.zeros(len(lanes), np.uint8)
+        has = self.sp[lanes] > 0
+        popped = lanes[has]
+        self.sp[popped] -= 1
+        vals[has] = self.stack[popped, self.sp[popped]]
+        return vals
+
+    def _opNoOp(self, lanes: np.ndarray, inst: np.ndarray):
+        pass
+
+    def _opLoadMem(self, lanes: np.ndarray, inst: np.ndarray):
+        self.register[lanes, (inst >> 8) & 0xf] = self.memory[lanes, inst & 0xff]
+
+    def _opLoad(self, lanes: np.ndarray, inst: np.ndarray):
+        self.register[lanes, (inst >> 8) & 0xf] = inst & 0xff
+
+    def _opStore(self, lanes: np.ndarray, inst: np.ndarray):
+        self.memory[lanes, inst & 0xff] = self.register[lanes, (inst >> 8) & 0xf]
+
+    def _opMove(self, lanes: np.ndarray, inst: np.ndarray):
+        spec = (inst >> 8) & 0xf
+        src = (inst >> 4) & 0xf
+        dest = inst & 0xf
+        reg = self.register
+
+        sel = spec == 0x0 # Standard registers
+        reg[lanes[sel], dest[sel]] = reg[lanes[sel], src[sel]]
+
+        sel = spec == 0x1 # From spec to normal
+        l, s, d = lanes[sel], src[sel], dest[sel]
+        m = s == asm.R_PGMI
+        bad = self.pgmi[l[m]] > 0xff
+        self._error(l[m][bad])
+        reg[l[m][~bad], d[m][~bad]] = self.pgmi[l[m][~bad]]
+        m = s == asm.R_STACK
+        reg[l[m], d[m]] = self._pop(l[m])
+        m = s == asm.R_EXIT
+        bad = self.exitCode[l[m]] < 0
+        self._error(l[m][bad])
+        reg[l[m][~bad], d[m][~bad]] = self.exitCode[l[m][~bad]]
+
+        sel = spec == 0x2 # From normal to spec
+        l, s, d = lanes[sel], src[sel], dest[sel]
+        vals = reg[l, s]
+        m = d == asm.R_PGMI
+        self.pgmi[l[m]] = vals[m]
+        m = d == asm.R_STACK
+        self._push(l[m], vals[m])
+        m = d == asm.R_EXIT
+        self.exitCode[l[m]] = vals[m]
+
+        sel = spec == 0x3 # From spec to spec
+        l, s, d = lanes[sel], src[sel], dest[sel]
+        vals = np.zeros(len(l), np.int32)
+        m = s == asm.R_PGMI
+        vals[m] = self.pgmi[l[m]]
+        m = s == asm.R_STACK
+        vals[m] = self._pop(l[m])
+        m = s == asm.R_EXIT
+        vals[m] = self.exitCode[l[m]]
+        bad = (vals < 0) | (vals > 0xff)
+        self._error(l[bad])
+        l, d, vals = l[~bad], d[~bad], vals[~bad]
+        m = d == asm.R_PGMI
+        self.pgmi[l[m]] = vals[m]
+        m = d == asm.R_STACK
+        full = self.sp[l[m]] > 0xff
+        self.exitCode[l[m][full]] = 1
+        self.stopped[l[m][full]] = STACK_OVERFLOW
+        self._push(l[m][~full], vals[m][~full].astype(np.uint8))
+        m = d == asm.R_EXIT
+        self.exitCode[l[m]] = vals[m]
+
+    def _opAddS(self, lanes: np.ndarray, inst: np.ndarray):
+        reg = self.register
+        reg[lanes, (inst >> 8) & 0xf] = reg[lanes, (inst >> 4) & 0xf] + reg[lanes, inst & 0xf]
+
+    def _opAddF(self, lanes: np.ndarray, inst: np.ndarray):
+        reg = self.register
+        a = reg[lanes, (inst >> 4) & 0xf].astype(np.int32)
+        b = reg[lanes, inst & 0xf]
+        reg[lanes, (inst >> 8) & 0xf] = np.frombuffer(addTable(), np.uint8)[(a << 8) | b]
+
+    def _opOr(self, lanes: np.ndarray, inst: np.ndarray):
+        reg = self.register
+        reg[lanes, (inst >> 8) & 0xf] = reg[lanes, (inst >> 4) & 0xf] | reg[lanes, inst & 0xf]
+
+    def _opAnd(self, lanes: np.ndarray, inst: np.ndarray):
+        reg = self.register
+        reg[lanes, (inst >> 8) & 0xf] = reg[lanes, (inst >> 4) & 0xf] & reg[lanes, inst & 0xf]
+
+    def _opXor(self, lanes: np.ndarray, inst: np.ndarray):
+        reg = self.register
+        reg[lanes, (inst >> 8) & 0xf] = reg[lanes, (inst >> 4) & 0xf] ^ reg[lanes, inst & 0xf]
+
+    def _opRotate(self, lanes: np.ndarray, inst: np.ndarray):
+        r = (inst >> 8) & 0xf
+        n = inst & 0x7
+        v = self.register[lanes, r].astype(np.int32)
+        self.register[lanes, r] = ((v >> n) | (v << (8 - n))) & 0xff
+
+    def _opJump(self, lanes: np.ndarray, inst: np.ndarray):
+        reg = self.register
+        take = reg[lanes, 0] == reg[lanes, (inst >> 8) & 0xf]
+        self.pgmi[lanes[take]] = inst[take] & 0xff
+
+    def _opHalt(self, lanes: np.ndarray, inst: np.ndarray):
+        self.stopped[lanes] = HALTED
+
+    def _opStoreP(self, lanes: np.ndarray, inst: np.ndarray):
+        adr = inst & 0xff
+        vals = self.register[lanes, (inst >> 8) & 0xf]
+        self.peripheral[lanes, adr] = vals
+        if self.consoleAdr is not None:
+            # The console prints anything non-zero written to it
+            con = adr == self.consoleAdr
+            printed = lanes[con & (vals > 0)]
+            chars = vals[con & (vals > 0)]
+            full = self.outLen[printed] >= self.output.shape[1]
+            self.stopped[printed[full]] = OUTPUT_CAPACITY
+            printed = printed[~full]
+            self.output[printed, self.outLen[printed]] = chars[~full]
+            self.outLen[printed] += 1
+
+    def _opLoadP(self, lanes: np.ndarray, inst: np.ndarray):
+        if self.consoleAdr is not None:
+            # The console always reads as 0
+            con = (inst & 0xff) == self.consoleAdr
+            self.peripheral[lanes[con], self.consoleAdr] = 0
+        self.register[lanes, (inst >> 8) & 0xf] = self.peripheral[lanes, inst & 0xff]
+
+    def _opJumpL(self, lanes: np.ndarray, inst: np.ndarray):
+        reg = self.register
+        take = reg[lanes, (inst >> 8) & 0xf] < reg[lanes, 0]
+        self.pgmi[lanes[take]] = inst[take] & 0xff
+
+    _ops = [
+        _opNoOp, _opLoadMem, _opLoad, _opStore,
+        _opMove, _opAddS, _opAddF, _opOr,
+        _opAnd, _opXor, _opRotate, _opJump,
+        _opHalt, _opStoreP, _opLoadP, _opJumpL,
+    ]